@@ -18,21 +18,27 @@
 # Authors:
 # - Thomas Winkler, ams AG, thomas.winkler@ams.com
 
-import json
-import multiprocessing
 import queue
+import selectors
 import socket
 import threading
-import warnings
+import time
+import weakref
 from abc import *
-from typing import List, Union, Dict
+from typing import List, Union, Dict, Set
 
 from dottmi.dott import dott
 from dottmi.dottexceptions import DottException
 from dottmi.gdb_mi import GdbMiContext
-from dottmi.gdb_shared import BpMsg, BpSharedConf
+from dottmi.gdb_shared import BpCmdList, BpMsg, BpSharedConf
 from dottmi.utils import log, cast_str
 
+# queue.SimpleQueue is only available from Python 3.7 on
+_SimpleQueue = getattr(queue, 'SimpleQueue', queue.Queue)
+
+# serialized 'finish and continue' message; sent after every intercept point hit
+_FINISH_CONT_BYTES: bytes = BpMsg(BpMsg.MSG_TYPE_FINISH_CONT).serialize()
+
 
 # Abstract base class defining common methods for all breakpoints
 class Breakpoint(ABC):
@@ -91,22 +97,74 @@ class Breakpoint(ABC):
 
 # -------------------------------------------------------------------------------------------------
 class HaltPoint(Breakpoint):
-    def __init__(self, location: str, temporary: bool = False, target: 'Target' = None):
+    def __init__(self, location: str, temporary: bool = False, target: 'Target' = None, _insert: bool = True):
         super().__init__(location, target)
         self._bp_info: Dict = None
-        self._q: queue.Queue = queue.Queue()
+        self._reached: threading.Event = threading.Event()
+        self._temporary: bool = temporary
 
-        args = ''
-        if temporary:
-            args += '-t'
+        # note: _insert is False if the breakpoint is inserted by install_many
+        if _insert:
+            try:
+                msg = self._dott_target.exec(self._insert_cmd())
+            except Exception as ex:
+                log.error('Creating breakpoint failed.')
+                log.exception(ex)
+                raise ex
+            self._inserted(msg)
 
+    @staticmethod
+    def install_many(locations: List[str], temporary: bool = False, target: 'Target' = None) -> List['HaltPoint']:
+        """
+        Creates a HaltPoint for each of the given locations. In contrast to creating them one by one, all breakpoint
+        insert commands are sent to GDB before waiting for the results.
+
+        Args:
+            locations: Breakpoint locations.
+            temporary: True to create temporary breakpoints.
+            target: Target on which the breakpoints are set. Default target is used if None.
+
+        Returns:
+            List of HaltPoints in the same order as the provided locations.
+        """
+        bps = [HaltPoint(location, temporary, target, _insert=False) for location in locations]
+        if len(bps) == 0:
+            return bps
+
+        target = bps[0]._dott_target
         try:
-            msg = self._dott_target.exec(f'-break-insert {args} {location}')
+            msgs = target.exec_many([bp._insert_cmd() for bp in bps], return_exceptions=True)
         except Exception as ex:
-            log.error('Creating breakpoint failed.')
+            log.error('Creating breakpoints failed.')
             log.exception(ex)
             raise ex
 
+        error = next((msg for msg in msgs if isinstance(msg, Exception)), None)
+        if error is not None:
+            # GDB has processed all insert commands. Delete the breakpoints which were inserted such that they do not
+            # remain armed without a HaltPoint (and a waiter) for them.
+            nums = [msg['payload']['bkpt']['number'] for msg in msgs
+                    if not isinstance(msg, Exception) and 'bkpt' in (msg.get('payload') or {})]
+            if len(nums) > 0:
+                try:
+                    target.exec(f'-break-delete {" ".join(nums)}')
+                except Exception as ex:
+                    log.exception(ex)
+            log.error('Creating breakpoints failed.')
+            log.exception(error)
+            raise error
+
+        for bp, msg in zip(bps, msgs):
+            bp._inserted(msg)
+        return bps
+
+    def _insert_cmd(self) -> str:
+        args = ''
+        if self._temporary:
+            args += '-t'
+        return f'-break-insert {args} {self._location}'
+
+    def _inserted(self, msg: Dict) -> None:
         if 'payload' in msg:
             payload = msg['payload']
             if 'bkpt' in payload:
@@ -122,17 +180,21 @@ class HaltPoint(Breakpoint):
 
     # allow the test thread to wait for a breakpoint event to occur
     def wait_complete(self, timeout: float = None) -> None:
-        try:
-            self._q.get(block=True, timeout=timeout)
-        except queue.Empty:
-            raise TimeoutError(f'Timeout while waiting to reach halt point at {self._location}.') from None
+        if not self._reached.wait(timeout):
+            raise TimeoutError(f'Timeout while waiting to reach halt point at {self._location}.')
+        self._reached.clear()
 
     def reached_internal(self, payload=None) -> None:
         self._hits += 1
-        self._dott_target.wait_halted()
+        if payload is not None and payload.get('reason') == 'breakpoint-hit':
+            # The stop notification delivered by the breakpoint handler already confirms that the target is halted.
+            # No need to wait until the target's own notification handler has caught up.
+            self._dott_target.set_halted_by_notification()
+        else:
+            self._dott_target.wait_halted()
         self.reached()
-        # queue is used to notify one potentially waiting thread
-        self._q.put(None, block=False)
+        # event is used to notify one potentially waiting thread
+        self._reached.set()
 
     def reached(self) -> None:
         # to be implemented by sub-class as needed
@@ -174,49 +236,259 @@ class Barrier(HaltPoint):
 class InterceptPointCmds(Breakpoint):
     def __init__(self, location: str, commands: List, target: 'Target' = None):
         super().__init__(location, target)
-        # serialize function name and commands using JSON and supply them to custom GDB command
-        com = json.dumps([location] + commands)
-        com = com.replace('"', '\\"')
+        self._warned: Set[str] = set()
+        # serialize function name and commands and supply them to custom GDB command
+        com = BpCmdList.encode([location] + commands)
         self._dott_target.exec(f'dott-bp-nostop-cmd {com}')
 
+    def _log_once(self, msg: str) -> None:
+        # The unsupported methods below are no-ops. Their (debug) message is only emitted on first use.
+        if msg not in self._warned:
+            self._warned.add(msg)
+            log.debug(msg)
+
     def wait_complete(self, timeout: float = None) -> None:
-        warnings.warn('You can not wait for the completion of a intercept breakpoint.')
+        self._log_once('You can not wait for the completion of a intercept breakpoint.')
 
     def exec(self, cmd: str) -> None:
-        warnings.warn('A command intercept point only executes the commands set in the constructor.')
+        self._log_once('A command intercept point only executes the commands set in the constructor.')
 
     def eval(self, cmd: str) -> None:
-        warnings.warn('A command intercept point only executes the commands set in the constructor.')
+        self._log_once('A command intercept point only executes the commands set in the constructor.')
 
     def ret(self, ret_val: Union[int, str] = None):
-        warnings.warn('A command intercept point only executes the commands set in the constructor.')
+        self._log_once('A command intercept point only executes the commands set in the constructor.')
 
     def reached(self) -> None:
-        warnings.warn('A command intercept point only executes the commands set in the constructor.')
+        self._log_once('A command intercept point only executes the commands set in the constructor.')
 
     def delete(self) -> None:
         self._dott_target.cli_exec(f'dott-bp-nostop-delete {self._location}')
 
     def get_hits(self) -> None:
-        warnings.warn('Unable to report hits for intercept point with command list.')
+        self._log_once('Unable to report hits for intercept point with command list.')
+
+
+# -------------------------------------------------------------------------------------------------
+class _InterceptListener(object):
+    """
+    Server socket accepting the connections from the GDB-side part of InterceptPoints. It is created once on first use
+    and then shared by all InterceptPoints (instead of binding and closing a server socket per InterceptPoint).
+    """
+    _instance: '_InterceptListener' = None
+    _instance_lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def get() -> '_InterceptListener':
+        with _InterceptListener._instance_lock:
+            if _InterceptListener._instance is None:
+                _InterceptListener._instance = _InterceptListener()
+            return _InterceptListener._instance
+
+    def __init__(self) -> None:
+        # note: port is chosen by the OS and passed to the custom GDB command
+        self._srv_sock: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._srv_sock.bind(('127.0.0.1', 0))
+        self._srv_sock.listen(8)
+        self._srv_sock.settimeout(BpSharedConf.ACCEPT_TIMEOUT_SECS)
+        self._port: int = self._srv_sock.getsockname()[1]
+
+        # Held while requesting a connection from GDB and accepting it. Ensures that the accepted connection
+        # belongs to the caller if InterceptPoints are created from multiple threads.
+        self.lock: threading.Lock = threading.Lock()
+
+    @property
+    def port(self) -> int:
+        return self._port
+
+    def accept(self) -> socket.socket:
+        try:
+            sock, addr = self._srv_sock.accept()
+        except socket.timeout:
+            raise DottException('GDB did not connect to InterceptPoint listener. Check GDB output for errors.') from None
+        sock.settimeout(None)
+        return sock
 
 
 # -------------------------------------------------------------------------------------------------
-class InterceptPoint(threading.Thread, Breakpoint):
-    _intercept_points = []
+class _InterceptDispatcher(threading.Thread):
+    """
+    Thread which waits for 'breakpoint hit' messages on the sockets of the InterceptPoints of one target and executes
+    the corresponding handlers. There is one dispatcher per target (i.e., per GDB process). GDB is blocked while
+    executing an InterceptPoint. Hence, at most one InterceptPoint of a target is active at a time and it is
+    sufficient to run the handlers of a target sequentially in its dispatcher thread. A handler which blocks does not
+    stall the InterceptPoints of other targets.
+    """
+    _instances: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+    _instances_lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def get(target: 'Target') -> '_InterceptDispatcher':
+        with _InterceptDispatcher._instances_lock:
+            dispatcher = _InterceptDispatcher._instances.get(target)
+            if dispatcher is None:
+                dispatcher = _InterceptDispatcher()
+                dispatcher.start()
+                _InterceptDispatcher._instances[target] = dispatcher
+                # terminate the dispatcher thread once the target is gone
+                weakref.finalize(target, dispatcher.stop)
+            return dispatcher
+
+    def __init__(self) -> None:
+        super().__init__(name='InterceptDispatcher', daemon=True)
+        self._selector: selectors.BaseSelector = selectors.DefaultSelector()
+
+        # The selector is only modified by the dispatcher thread itself. Other threads queue their requests and
+        # wake up the dispatcher via a socket pair (pipes can not be used with select on Windows).
+        self._requests: queue.Queue = _SimpleQueue()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._stopped: bool = False
+        self._active: 'InterceptPoint' = None  # InterceptPoint whose hit is currently being processed
+
+    def _request(self, func, ipoint: 'InterceptPoint', done: threading.Event = None) -> None:
+        self._requests.put((func, ipoint, done))
+        try:
+            self._wake_w.send(b'\x00')
+        except OSError:
+            pass  # dispatcher already stopped
+
+    def add(self, ipoint: 'InterceptPoint') -> None:
+        self._request(self._register, ipoint)
+
+    def remove(self, ipoint: 'InterceptPoint', timeout: float = None) -> bool:
+        """
+        Stops dispatching for the given InterceptPoint and closes its socket. Blocks until the dispatcher has processed
+        the request. If the request is not processed within the given timeout, it is still processed later on (i.e., the
+        socket is not closed while it is still registered with the dispatcher).
+
+        Returns:
+            True if the request was processed within the given timeout, False otherwise.
+        """
+        if threading.current_thread() is self:
+            # InterceptPoint deleted from within a reached() handler. If it is the one currently being processed, it
+            # is unregistered after the 'finish and continue' message was sent (see run).
+            if ipoint is not self._active:
+                self._unregister(ipoint)
+            return True
+        done = threading.Event()
+        self._request(self._unregister, ipoint, done)
+        return done.wait(timeout)
+
+    def stop(self) -> None:
+        self._request(None, None)
+
+    def _register(self, ipoint: 'InterceptPoint') -> None:
+        try:
+            self._selector.register(ipoint._sock, selectors.EVENT_READ, ipoint)
+        except KeyError:
+            # stale registration of a socket which was closed and whose file descriptor was re-used
+            stale = self._selector.get_map()[ipoint._sock.fileno()]
+            log.warn('Intercept point dispatcher: dropping stale socket registration.')
+            self._drop(stale)
+            self._selector.register(ipoint._sock, selectors.EVENT_READ, ipoint)
+
+    def _unregister(self, ipoint: 'InterceptPoint') -> None:
+        try:
+            self._selector.unregister(ipoint._sock)
+        except (KeyError, ValueError):
+            pass  # already unregistered
+        ipoint._close()
+
+    def _drop(self, key: selectors.SelectorKey) -> None:
+        self._selector.unregister(key.fileobj)
+        if key.data is not None:
+            key.data._running = False
+            key.data._close()
+
+    def _drop_closed(self) -> bool:
+        dropped = False
+        for key in list(self._selector.get_map().values()):
+            if key.fileobj is not self._wake_r and key.fileobj.fileno() == -1:
+                self._drop(key)
+                dropped = True
+        return dropped
+
+    def _process_requests(self) -> None:
+        try:
+            self._wake_r.recv(4096)
+        except BlockingIOError:
+            pass
+        while not self._requests.empty():
+            func, ipoint, done = self._requests.get()
+            if func is None:
+                self._stopped = True
+                continue
+            try:
+                func(ipoint)
+            except Exception as ex:
+                log.warn(f'Intercept point dispatcher: request for {ipoint.get_location()} failed.')
+                log.exception(ex)
+            finally:
+                if done is not None:
+                    done.set()
+
+    def run(self) -> None:
+        while not self._stopped:
+            try:
+                events = self._selector.select()
+            except (OSError, ValueError) as ex:
+                # e.g., a socket which was closed while still being registered
+                log.warn(f'Intercept point dispatcher: waiting for sockets failed ({ex}).')
+                if not self._drop_closed():
+                    time.sleep(0.1)  # do not spin if the error persists
+                continue
+
+            for key, mask in events:
+                if key.fileobj is self._wake_r:
+                    self._process_requests()
+                    continue
+
+                if key.fd not in self._selector.get_map():
+                    continue  # unregistered by a request processed in this iteration
+
+                ipoint: 'InterceptPoint' = key.data
+                self._active = ipoint
+                try:
+                    keep = ipoint._process_hit()
+                except Exception as ex:
+                    log.exception(ex)
+                    keep = False
+                finally:
+                    self._active = None
+                if not keep:
+                    self._unregister(ipoint)
+                    ipoint._running = False
+
+        for key in list(self._selector.get_map().values()):
+            if key.data is not None:
+                key.data._running = False
+                key.data._close()
+        self._selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
+
+
+# -------------------------------------------------------------------------------------------------
+class InterceptPoint(Breakpoint):
+    _intercept_points: Set['InterceptPoint'] = set()
 
     @staticmethod
     def _register(ipoint: 'InterceptPoint') -> None:
-        InterceptPoint._intercept_points.append(ipoint)
+        InterceptPoint._intercept_points.add(ipoint)
 
     @staticmethod
     def _unregister(ipoint: 'InterceptPoint') -> None:
-        InterceptPoint._intercept_points.remove(ipoint)
+        InterceptPoint._intercept_points.discard(ipoint)
 
     @staticmethod
     def delete_all() -> None:
+        # common case: tests without intercept points
+        if not InterceptPoint._intercept_points:
+            return
         # iterate over a copy
-        for item in InterceptPoint._intercept_points[:]:
+        for item in list(InterceptPoint._intercept_points):
             item.delete()
         if len(InterceptPoint._intercept_points) != 0:
             log.warn('Not all Intercept points were deleted!')
@@ -224,31 +496,31 @@ class InterceptPoint(threading.Thread, Breakpoint):
     # ---------------------------------------------------------------------------------------------
     def __init__(self, location: str, target: 'Target' = None):
         Breakpoint.__init__(self, location, target)
-        threading.Thread.__init__(self, name='InterceptPoint')
         self._running: bool = False
-        self._event: multiprocessing.Event = multiprocessing.Event()
+        self._event: threading.Event = threading.Event()
         self._event.clear()
-
-        # open server socket for incoming connection from custom GDB command
-        srv_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        srv_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        srv_sock.bind(('127.0.0.1', BpSharedConf.GDB_CMD_SERVER_PORT))
-        srv_sock.listen(1)
-
-        # call custom GDB command
-        self._dott_target.cli_exec(f'dott-bp-nostop-tcp {self._location}')
-
-        self._sock, addr = srv_sock.accept()
-        srv_sock.close()
+        # GDB MI context switched on every hit; looked up once here
+        self._mi_context: GdbMiContext = self._dott_target.gdb_client.gdb_mi.context
+
+        # call custom GDB command which connects back to the (shared) listener
+        listener = _InterceptListener.get()
+        with listener.lock:
+            self._dott_target.cli_exec(f'dott-bp-nostop-tcp {listener.port} {self._location}')
+            self._sock = listener.accept()
+        BpSharedConf.setup_socket(self._sock)
+        # buffered reader such that message header and payload can be served by a single recv call
+        self._rfile = self._sock.makefile('rb', buffering=64 * 1024)
 
         InterceptPoint._register(self)
-        self.start()
+        self._running = True
+        self._dispatcher: _InterceptDispatcher = _InterceptDispatcher.get(self._dott_target)
+        self._dispatcher.add(self)
 
     def exec(self, cmd: str) -> None:
         msg = BpMsg(BpMsg.MSG_TYPE_EXEC, payload=bytes(cmd, 'ascii'))
         msg.send_to_socket(self._sock)
 
-        res = BpMsg.read_from_socket(self._sock)
+        res = BpMsg.read_from_stream(self._rfile)
         if res.get_type() == BpMsg.MSG_TYPE_EXCEPT:
             raise RuntimeError(f'Execution of command "{cmd}" in breakpoint context failed. '
                                f'{res.get_payload().decode("ascii")}')
@@ -257,7 +529,7 @@ class InterceptPoint(threading.Thread, Breakpoint):
         msg = BpMsg(BpMsg.MSG_TYPE_EVAL, payload=bytes(cmd, 'ascii'))
         msg.send_to_socket(self._sock)
 
-        res = BpMsg.read_from_socket(self._sock)
+        res = BpMsg.read_from_stream(self._rfile)
         if res.get_type() == BpMsg.MSG_TYPE_EXCEPT:
             raise RuntimeError(f'Execution of command "{cmd}" in breakpoint context failed. '
                                f'{res.get_payload().decode("ascii")}')
@@ -297,58 +569,74 @@ class InterceptPoint(threading.Thread, Breakpoint):
         elif (not wait_ok) and (not timeout_override):
             raise TimeoutError(f'Breakpoint {self._location} not reached after timeout of {timeout}secs.')
 
-    def run(self) -> None:
-        self._running = True
+    def _process_hit(self) -> bool:
+        """
+        Called by the dispatcher thread when the socket connected to GDB became readable.
 
-        while self._running:
-            # wait for 'breakpoint hit' message
-            try:
-                msg = BpMsg.read_from_socket(self._sock)
-                if msg.get_type() != BpMsg.MSG_TYPE_HIT:
-                    log.warn(f'Received breakpoint message of type {msg.get_type()} while waiting for type "HIT"')
-                self._hits += 1
-            except ConnectionAbortedError:
-                log.warn(f'Breakpoint {self._location}: connection aborted')
-                self._running = False
-                break
-            except ConnectionResetError:
-                log.warn(f'Breakpoint {self._location}: connection reset')
-                self._running = False
-                break
-            except Exception as ex:
-                if self._running:
-                    log.warn(f'Breakpoint {self._location}: exception: {str(ex)}')
-                    self._running = False
-                else:
-                    # Got a socket error while no longer supposed to be running (i.e., during delete).
-                    # We don't need to do anything about this.
-                    pass
-                break
+        Returns:
+            True if the InterceptPoint shall remain registered with the dispatcher, False otherwise.
+        """
+        # Note: Messages are exchanged strictly in request/response manner. Hence, the buffered reader holds no data
+        # while the dispatcher waits for the socket to become readable.
+        # read 'breakpoint hit' message
+        try:
+            msg = BpMsg.read_from_stream(self._rfile)
+            if msg.get_type() != BpMsg.MSG_TYPE_HIT:
+                log.warn(f'Received breakpoint message of type {msg.get_type()} while waiting for type "HIT"')
+            self._hits += 1
+        except ConnectionAbortedError:
+            log.warn(f'Breakpoint {self._location}: connection aborted')
+            return False
+        except ConnectionResetError:
+            log.warn(f'Breakpoint {self._location}: connection reset')
+            return False
+        except Exception as ex:
+            if self._running:
+                log.warn(f'Breakpoint {self._location}: exception: {str(ex)}')
+            else:
+                # Got a socket error while no longer supposed to be running (i.e., during delete).
+                # We don't need to do anything about this.
+                pass
+            return False
 
-            try:
-                self._dott_target.gdb_client.gdb_mi.context.acquire_context(self, GdbMiContext.BP_INTERCEPT)
-                self.reached()
-            except Exception as ex:
-                log.exception(ex)
-                log.warn('Breakpoint execution failed. Letting target continue anyway. '
-                         'Remaining breakpoint commands in "reached" are discarded')
-            finally:
-                self._dott_target.gdb_client.gdb_mi.context.release_context(self)
+        try:
+            self._mi_context.acquire_context(self, GdbMiContext.BP_INTERCEPT)
+            self.reached()
+        except Exception as ex:
+            log.exception(ex)
+            log.warn('Breakpoint execution failed. Letting target continue anyway. '
+                     'Remaining breakpoint commands in "reached" are discarded')
+        finally:
+            self._mi_context.release_context(self)
 
-            msg = BpMsg(BpMsg.MSG_TYPE_FINISH_CONT)
-            msg.send_to_socket(self._sock)
+        self._sock.sendall(_FINISH_CONT_BYTES)
 
-            # notify threads which are potentially waiting for completion of this breakpoint
-            self._signal_complete()
+        # notify threads which are potentially waiting for completion of this breakpoint
+        self._signal_complete()
+        return self._running  # False if deleted from within reached()
+
+    def _close(self) -> None:
+        # note: only called by the dispatcher once the socket is no longer registered with it
+        try:
+            self._rfile.close()
+            self._sock.close()
+        except Exception:
+            pass
 
     def delete(self) -> None:
         try:
             if self._running:
                 self._running = False
+                # Stop dispatching before GDB closes its end of the connection. Hence, teardown does not depend on
+                # the dispatcher running into an EOF or connection error.
+                # The dispatcher also closes the socket. If it is busy (e.g., executing reached()), this happens once
+                # it gets to process the request.
+                if not self._dispatcher.remove(self, timeout=1):
+                    log.warn(f'Breakpoint {self._location}: dispatcher did not release intercept point in time.')
                 self._dott_target.cli_exec(f'dott-bp-nostop-delete {self._location}', timeout=1)
-                self._sock.close()
-                self.join(timeout=1)
-                InterceptPoint._unregister(self)
+            # note: if the connection to GDB was already lost (i.e., no longer running), the dispatcher has already
+            # released the intercept point and closed the socket
+            InterceptPoint._unregister(self)
         except:
             pass
 
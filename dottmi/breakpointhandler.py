@@ -18,9 +18,8 @@
 # Authors:
 # - Thomas Winkler, ams AG, thomas.winkler@ams.com
 
-import queue
 import threading
-from typing import Dict
+from typing import Dict, List, Optional
 
 from dottmi.breakpoint import Breakpoint
 from dottmi.gdb_mi import NotifySubscriber
@@ -32,32 +31,39 @@ class BreakpointHandler(NotifySubscriber, threading.Thread):
     def __init__(self) -> None:
         NotifySubscriber.__init__(self)
         threading.Thread.__init__(self, name='BreakpointHandler')
-        self._breakpoints: Dict = {}
+        # GDB assigns breakpoint numbers densely (starting at 1). Hence, the breakpoint number is directly used as
+        # index into this list; unused numbers hold None.
+        self._breakpoints: List[Optional[Breakpoint]] = []
         self._running: bool = False
 
     def add_bp(self, bp: Breakpoint) -> None:
+        if bp.num >= len(self._breakpoints):
+            self._breakpoints.extend([None] * (bp.num + 1 - len(self._breakpoints)))
         self._breakpoints[bp.num] = bp
 
     def remove_bp(self, bp: Breakpoint) -> None:
-        self._breakpoints.pop(bp.num)
+        self._breakpoints[bp.num] = None
 
     def stop(self) -> None:
         self._running = False
+        # wake up the handler thread which is blocked while waiting for the next notification
+        self._notifications.put(None)
 
     def run(self) -> None:
         self._running = True
         while self._running:
-            try:
-                msg: Dict = self.wait_for_notification(True, timeout=0.1)
-            except queue.Empty:
-                continue
+            msg: Dict = self.wait_for_notification(True)
+            if msg is None:
+                # shutdown sentinel put by stop()
+                break
 
-            if 'reason' in msg['payload']:
-                payload = msg['payload']
+            payload = msg['payload']
+            if 'reason' in payload:
                 if payload['reason'] == 'breakpoint-hit':
-                    bp_num = int(payload['bkptno'])
-                    if bp_num in self._breakpoints:
-                        self._breakpoints[bp_num].reached_internal(payload)
+                    bp_num: int = payload['bkptno']  # converted to int by GdbMiResponseHandler
+                    bp = self._breakpoints[bp_num] if bp_num < len(self._breakpoints) else None
+                    if bp is not None:
+                        bp.reached_internal(payload)
                     else:
                         log.warn(f'Breakpoint with number {bp_num} not found in list of known breakpoints.')
                 else:
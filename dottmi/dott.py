@@ -19,10 +19,13 @@
 # - Thomas Winkler, ams AG, thomas.winkler@ams.com
 
 import configparser
-import glob
+import functools
+import json
 import os
 import os.path
 import platform
+import re
+import shutil
 import socket
 import subprocess
 import sys
@@ -30,13 +33,131 @@ import types
 from ctypes import CDLL
 from importlib.machinery import SourceFileLoader
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from dottmi.dottexceptions import DottException
 from dottmi.target_mem import TargetMemModel
 from dottmi.utils import log, log_setup, singleton
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+# dott.ini files only use flat 'key = value' items. These are read with the two regexes below; anything outside of
+# this subset (continuation lines, ':' delimiters, DEFAULT section) is left to configparser.
+_INI_SECTION_RE = re.compile(r'^\[([^\]]+)\]\s*$')
+_INI_KV_RE = re.compile(r'^([^=;#\s][^=]*?)\s*=\s*(.*?)\s*$')
+
+
+def _fast_ini_parse(ini_path: str, section: str) -> Optional[Dict[str, str]]:
+    """
+    Read the items of the given section from an ini file. Keys are lower-cased as done by configparser.
+
+    Args:
+        ini_path: Path of the ini file.
+        section: Name of the section to read.
+    Returns:
+        The items of the section or None if the section is not present.
+    Raises:
+        ValueError: If the file uses ini features which are not supported by this parser.
+    """
+    items: Optional[Dict[str, str]] = None
+    in_section: bool = False
+
+    with open(ini_path, 'r') as f:
+        lines = f.read().splitlines()
+
+    for line in lines:
+        if line.strip() == '' or line.lstrip()[0] in '#;':
+            continue
+        if line[0].isspace():
+            raise ValueError('continuation lines are not supported')
+
+        m = _INI_SECTION_RE.match(line)
+        if m is not None:
+            if m.group(1) == 'DEFAULT':
+                raise ValueError('DEFAULT section is not supported')
+            in_section = m.group(1) == section
+            if in_section and items is None:
+                items = {}
+            continue
+
+        m = _INI_KV_RE.match(line)
+        if m is None:
+            raise ValueError(f'unsupported line: {line}')
+        if in_section:
+            items[m.group(1).lower()] = m.group(2)
+
+    return items
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+_PLATFORM: str = platform.system()
+
+# Platform specific J-Link defaults: default Segger search paths, GDB server binary name and J-Link library name
+if _PLATFORM == 'Linux':
+    _JLINK_DEFAULTS = ((str(Path('/opt/SEGGER')),),
+                       'JLinkGDBServerCLExe',
+                       'libjlinkarm.so')
+else:
+    _JLINK_DEFAULTS = ((str(Path('C:/Program Files (x86)/SEGGER')), str(Path('C:/Program Files/SEGGER'))),
+                       'JLinkGDBServerCL.exe',
+                       'JLink_x64.dll')
+
+# Names of the supported on-target memory models
+_MEM_MODEL_KEYS = frozenset(TargetMemModel.get_keys())
+
+# Result of the (expensive) J-Link installation lookup is cached in this file.
+_JLINK_CACHE_FILE: str = os.path.join(os.path.expanduser('~'), '.cache', 'dott', 'jlink.json')
+# Version encoded in the name of Segger's install folders (e.g., JLink_V652d -> 6.52d) and versions of libraries
+# already looked at (library path -> version as returned by JLINKARM_GetDLLVersion; None if it can't be loaded).
+_JLINK_DIR_VERSION_RE = re.compile(r'^JLink_V(\d)(\d{2})([a-z]?)$', re.IGNORECASE)
+_jlink_lib_versions: Dict[str, Optional[int]] = {}
+
+
+@functools.lru_cache(maxsize=None)
+def _probe_gdb(gdb_exe: str) -> bool:
+    # Checks that the given gdb binary can be started (i.e., all shared libraries it depends on are present).
+    try:
+        subprocess.run([gdb_exe, '--version'], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=True, timeout=2)
+        return True
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+_LOOPBACK_ADDR: str = '127.0.0.1'
+
+
+@functools.lru_cache(maxsize=None)
+def _resolve_ipv4(addr: str) -> str:
+    # Resolve an IPv4 address or host name once such that port probing binds to a numeric address.
+    return socket.getaddrinfo(addr, 0, socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# The GDB and target modules are only imported once a target is actually created. The imported modules are kept at
+# module level to skip the import machinery on subsequent target creations.
+_gdb_mod: Optional[types.ModuleType] = None
+_target_mod: Optional[types.ModuleType] = None
+
+
+def _gdb_module() -> types.ModuleType:
+    global _gdb_mod
+    if _gdb_mod is None:
+        import dottmi.gdb
+        _gdb_mod = dottmi.gdb
+    return _gdb_mod
+
+
+def _target_module() -> types.ModuleType:
+    global _target_mod
+    if _target_mod is None:
+        import dottmi.target
+        _target_mod = dottmi.target
+    return _target_mod
+
+
+# ----------------------------------------------------------------------------------------------------------------------
 class DottHooks(object):
     _pre_connect_hook: types.FunctionType = None
 
@@ -53,9 +174,25 @@ class DottHooks(object):
 @singleton
 class Dott(object):
 
-    def __init__(self) -> None:
+    def __init__(self, connect: bool = False) -> None:
+        """
+        Args:
+            connect: If True, the configuration is read and the default target is connected right away. Otherwise,
+                     this is deferred until the default target is accessed for the first time.
+        """
         self._default_target = None
+        self._default_target_created: bool = False
+        self._setup_done: bool = False
         self._all_targets: List = []
+        # the port number used by the internal auto port discovery; discovery starts at config's gdb server port
+        self._next_gdb_srv_port: int = 0
+
+        if connect:
+            self._connect()
+
+    def _setup(self) -> None:
+        if self._setup_done:
+            return
 
         # initialize logging subsystem
         log_setup()
@@ -63,13 +200,17 @@ class Dott(object):
         # read and pre-process configuration file
         DottConf.parse_config()
 
-        # the port number used by the internal auto port discovery; discovery starts at config's gdb server port
-        self._next_gdb_srv_port: int = int(DottConf.conf['gdb_server_port'])
+        self._next_gdb_srv_port = DottConf.cfg.gdb_server_port
+        self._setup_done = True
+
+    def _connect(self) -> None:
+        self._setup()
 
         # Hook called before the first debugger connection is made
         DottHooks.exec_pre_connect_hook()
 
-        self._default_target = self.create_target(DottConf.conf['device_name'], DottConf.conf['jlink_serial'])
+        self._default_target = self.create_target(DottConf.cfg.device_name, DottConf.cfg.jlink_serial)
+        self._default_target_created = True
 
     def _get_next_srv_port(self, srv_addr: str) -> int:
         """
@@ -81,34 +222,39 @@ class Dott(object):
         Returns:
             Returns the first port number of the discovered, free port triplet.
         """
+        srv_ip: str = _resolve_ipv4(srv_addr)
         port = self._next_gdb_srv_port
-        sequentially_free_ports = 0
-        start_port = 0
 
+        # JLINK GDB server needs 3 free ports in a row. All three ports of a candidate triplet are bound at the same
+        # time; if one of them is in use, the search continues right after the port in use.
         while True:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            if port + 2 >= 65535:
+                raise DottException(f'Unable do find three (consecutive) free ports for IP {srv_addr}!')
+
+            socks: List[socket.socket] = []
+            fail_idx: int = -1
             try:
-                s.bind((srv_addr, port))
-                sequentially_free_ports += 1
-                if sequentially_free_ports == 1:
-                    start_port = port
-            except socket.error:
-                # log.debug(f'Can not bind port {port} as it is already in use.')
-                sequentially_free_ports = 0
+                for i in range(3):
+                    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    socks.append(s)
+                    try:
+                        s.bind((srv_ip, port + i))
+                    except socket.error:
+                        # log.debug(f'Can not bind port {port + i} as it is already in use.')
+                        fail_idx = i
+                        break
             finally:
-                s.close()
+                for s in socks:
+                    s.close()
 
-            if sequentially_free_ports > 2:
-                # JLINK GDB server needs 3 free ports in a row
+            if fail_idx < 0:
                 break
+            port += fail_idx + 1
 
-            port += 1
-            if port >= 65535:
-                raise DottException(f'Unable do find three (consecutive) free ports for IP {srv_addr}!')
-
-        self._next_gdb_srv_port = start_port + sequentially_free_ports
+        start_port = port
+        self._next_gdb_srv_port = start_port + 3
         if self._next_gdb_srv_port > 65500:
-            self._next_gdb_srv_port = int(DottConf.conf['gdb_server_port'])
+            self._next_gdb_srv_port = DottConf.cfg.gdb_server_port
         return start_port
 
     def create_gdb_server(self, dev_name: str, jlink_serial: str = None, srv_addr: str = None, srv_port: int = -1) -> 'GdbServer':
@@ -124,45 +270,47 @@ class Dott(object):
         Returns:
             The created GdbServer instance.
         """
-        from dottmi.gdb import GdbServerJLink
+        self._setup()
+        gdb_mod = _gdb_module()
 
         if srv_port == -1:
-            srv_port = int(DottConf.conf['gdb_server_port'])
+            srv_port = DottConf.cfg.gdb_server_port
 
         if srv_addr is None:
-            srv_addr = DottConf.conf['gdb_server_addr']
+            srv_addr = DottConf.cfg.gdb_server_addr
 
         if srv_addr is None:
             # if gdb server is launched by DOTT, we determine the port ourselves
-            srv_port = self._get_next_srv_port('127.0.0.1')
-
-        gdb_server = GdbServerJLink(DottConf.conf['gdb_server_binary'],
-                                    srv_addr,
-                                    srv_port,
-                                    dev_name,
-                                    DottConf.conf['jlink_interface'],
-                                    DottConf.conf['device_endianess'],
-                                    DottConf.conf['jlink_speed'],
-                                    jlink_serial,
-                                    DottConf.conf['jlink_server_addr'])
+            srv_port = self._get_next_srv_port(_LOOPBACK_ADDR)
+
+        gdb_server = gdb_mod.GdbServerJLink(DottConf.cfg.gdb_server_binary,
+                                           srv_addr,
+                                           srv_port,
+                                           dev_name,
+                                           DottConf.cfg.jlink_interface,
+                                           DottConf.cfg.device_endianess,
+                                           DottConf.cfg.jlink_speed,
+                                           jlink_serial,
+                                           DottConf.cfg.jlink_server_addr)
 
         return gdb_server
 
     def create_target(self, dev_name: str, jlink_serial: str = None) -> 'Target':
-        from dottmi import target
-        from dottmi.gdb import GdbClient
+        self._setup()
+        target_mod = _target_module()
+        gdb_mod = _gdb_module()
 
-        srv_addr = DottConf.conf['gdb_server_addr']
+        srv_addr = DottConf.cfg.gdb_server_addr
 
         try:
             gdb_server = self.create_gdb_server(dev_name, jlink_serial, srv_addr=srv_addr)
 
             # start GDB Client
-            gdb_client = GdbClient(DottConf.conf['gdb_client_binary'])
+            gdb_client = gdb_mod.GdbClient(DottConf.cfg.gdb_client_binary)
             gdb_client.connect()
 
             # create target instance and set GDB server address
-            target = target.Target(gdb_server, gdb_client)
+            target = target_mod.Target(gdb_server, gdb_client)
 
         except TimeoutError:
             target = None
@@ -174,6 +322,8 @@ class Dott(object):
 
     @property
     def target(self):
+        if not self._default_target_created:
+            self._connect()
         return self._default_target
 
     @target.setter
@@ -192,20 +342,118 @@ def dott() -> Dott:
     return Dott()
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+# Reads the configuration and connects to the default target (if not already done) and returns the default target.
+def connect() -> 'Target':
+    return Dott().target
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Converters for config values read from dott.ini (or set programmatically). Invalid values raise a ValueError.
+def _existing_path(val: str) -> str:
+    if DottConf._stat(val) is None:
+        raise ValueError(f'{val} does not exist.')
+    return val
+
+
+def _hex_int(val) -> int:
+    return int(val, base=16) if isinstance(val, str) else int(val)
+
+
+def _endianess(val: str) -> str:
+    if val != 'little' and val != 'big':
+        raise ValueError(f'device_endianess in dott.ini should be either "little" or "big".')
+    return val
+
+
+def _strip(val: str) -> str:
+    return val.strip()
+
+
+def _mem_model(val) -> TargetMemModel:
+    if isinstance(val, TargetMemModel):
+        return val
+    val = str(val).upper()
+    if val not in _MEM_MODEL_KEYS:
+        log.warn(f'On-target memory model ({val}) from dott.ini is unknown. Falling back to default.')
+        return _DEFAULT_MEM_MODEL
+    return TargetMemModel[val]
+
+
+# marks config options which do not have a default value and must be set
+_REQUIRED = object()
+_DEFAULT_MEM_MODEL: TargetMemModel = TargetMemModel.TESTHOOK
+
+# Config schema. Each entry is a tuple of:
+#   key:         Name of the config option.
+#   default:     Value used if the option is not set or empty. Callables get the config dict and return the default.
+#   convert:     Applied to values which are set (None: value is kept as is).
+#   label:       Format string for the config summary (None: option is not logged).
+#   log_default: Whether or not the option is logged if it is at its default value.
+# Schemas are applied in order, i.e., defaults can refer to options which appear earlier in the schema.
+_CONF_SCHEMA_TARGET = (
+    ('bl_load_elf', None, _existing_path, 'BL ELF (load):         {}', True),
+    # if no symbol file is specified assume that symbols are contained in the load file
+    ('bl_symbol_elf', lambda conf: conf['bl_load_elf'], _existing_path, 'BL ELF (symbol):       {}', True),
+    ('bl_symbol_addr', 0x0, _hex_int, 'BL ADDR (symbol):      0x{:x}', True),
+    ('app_load_elf', _REQUIRED, _existing_path, 'APP ELF (load):        {}', True),
+    ('app_symbol_elf', lambda conf: conf['app_load_elf'], _existing_path, 'APP ELF (symbol):      {}', True),
+    ('device_name', 'unknown', None, 'Device name:           {}', True),
+    ('device_endianess', 'little', _endianess, 'Device endianess:      {}', True),
+)
+
+_CONF_SCHEMA_CONNECTION = (
+    ('jlink_interface', 'SWD', None, 'J-LINK interface:      {}', True),
+    ('jlink_speed', '15000', None, 'J-LINK speed (set):    {}', True),
+    ('jlink_serial', None, None, 'J-LINK serial:         {}', False),
+    ('gdb_client_binary', lambda conf: str(Path(f'{os.environ["DOTTGDBPATH"]}/arm-none-eabi-gdb-py')), None,
+     'GDB client binary:     {}', True),
+    ('gdb_server_addr', None, _strip, 'GDB server address:    {}', True),
+    ('gdb_server_port', 2331, int, 'GDB server port:       {}', True),
+    ('jlink_server_addr', None, None, 'JLINK server address:  {}', False),
+    ('jlink_server_port', '19020', None, 'JLINK server port:     {}', False),
+)
+
+_CONF_SCHEMA_MEM = (
+    ('on_target_mem_model', _DEFAULT_MEM_MODEL, _mem_model, None, False),
+    ('on_target_mem_prestack_alloc_size', 256, int, None, False),
+    ('on_target_mem_prestack_alloc_location', '_main_init', str, None, False),
+    ('on_target_mem_prestack_halt_location', 'main', str, None, False),
+    ('on_target_mem_prestack_total_stack_size', None, int, None, False),
+)
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 # Central Dott configuration registry. Data is read in from dott ini file. Additional settings can be made via
 # project specific conftest files.
 class DottConf:
     conf = {}
+    # attribute-style view of conf; created at the end of parse_config
+    cfg: Optional[types.SimpleNamespace] = None
     dott_runtime = None
+    _dott_runtime_path: Optional[str] = None
+    # stat results of files and folders referenced by the configuration; only valid during a parse_config run
+    _stat_cache: Dict[str, Optional[os.stat_result]] = {}
+
+    @staticmethod
+    def _stat(path: str) -> Optional[os.stat_result]:
+        # stat() with result caching; returns None if the path does not exist
+        if path not in DottConf._stat_cache:
+            try:
+                DottConf._stat_cache[path] = os.stat(path)
+            except OSError:
+                DottConf._stat_cache[path] = None
+        return DottConf._stat_cache[path]
 
     @staticmethod
     def set(key: str, val: str) -> None:
         DottConf.conf[key] = val
+        if DottConf.cfg is not None:
+            setattr(DottConf.cfg, key, val)
 
     @staticmethod
     def set_runtime_if_unset(dott_runtime_path: str) -> None:
-        if not os.path.exists(dott_runtime_path):
+        if DottConf._stat(dott_runtime_path) is None:
             raise ValueError(f'Provided DOTT runtime path ({dott_runtime_path}) does not exist.')
         if os.environ.get('DOTTRUNTIME') is None:
             os.environ['DOTTRUNTIME'] = dott_runtime_path
@@ -219,40 +467,41 @@ class DottConf:
         DottConf.set('DOTTRUNTIME', None)
 
         dott_runtime_path = sys.prefix + os.sep + 'dott_data'
-        if os.path.exists(dott_runtime_path):
+        if DottConf._stat(dott_runtime_path) is not None:
             runtime_version: str = 'unknown'
-            with Path(dott_runtime_path + '/apps/version.txt').open() as f:
-                line = f.readline()
-                while line:
-                    if 'version:' in line:
-                        runtime_version = line.lstrip('version:').strip()
-                        break
-                    line = f.readline()
-            os.environ['DOTTGDBPATH'] = str(Path(f'{dott_runtime_path}/apps/gdb/bin'))
-            os.environ['PYTHONPATH27'] = str(Path(f'{dott_runtime_path}/apps/python27/python-2.7.13'))
+            _, sep, rest = Path(dott_runtime_path + '/apps/version.txt').read_text().partition('version:')
+            if sep:
+                runtime_version = rest.split('\n', 1)[0].strip()
+            gdb_path: str = str(Path(f'{dott_runtime_path}/apps/gdb/bin'))
+            python27_path: str = str(Path(f'{dott_runtime_path}/apps/python27/python-2.7.13'))
+            os.environ['DOTTGDBPATH'] = gdb_path
+            os.environ['PYTHONPATH27'] = python27_path
             DottConf.set('DOTTRUNTIME', f'{dott_runtime_path} (dott-runtime package)')
             DottConf.set('DOTT_RUNTIME_VER', runtime_version)
-            DottConf.set('DOTTGDBPATH', str(Path(f'{dott_runtime_path}/apps/gdb/bin')))
-            DottConf.set('PYTHONPATH27', str(Path(f'{dott_runtime_path}/apps/python27/python-2.7.13')))
+            DottConf.set('DOTTGDBPATH', gdb_path)
+            DottConf.set('PYTHONPATH27', python27_path)
 
             # Linux: check if libpython2.7 and libnurses5 are installed. Windows: They are included in the DOTT runtime.
-            if platform.system() == 'Linux':
-                res = os.system(str(Path(f'{dott_runtime_path}/apps/gdb/bin/arm-none-eabi-gdb-py')))
-                if res != 0:
+            if _PLATFORM == 'Linux':
+                if not _probe_gdb(str(Path(f'{gdb_path}/arm-none-eabi-gdb-py'))):
                     raise DottException('Unable to start gdb client. This might be caused by missing dependencies.\n'
                                         'Make sure that libpython2.7 and libncurses5 are installed.')
 
-        # If DOTTRUNTIME is set in the environment it overrides the integrated runtime in dott_data
-        if os.environ.get('DOTTRUNTIME') is not None and os.environ.get('DOTTRUNTIME').strip() != '':
-            dott_runtime_path = os.environ.get('DOTTRUNTIME')
-            dott_runtime_path = dott_runtime_path.strip()
+        # If DOTTRUNTIME is set in the environment it overrides the integrated runtime in dott_data. Note: The
+        # environment is read here (and not at import time) as DOTTRUNTIME might be set via set_runtime_if_unset.
+        env_runtime: Optional[str] = os.environ.get('DOTTRUNTIME')
+        if env_runtime is not None and env_runtime.strip() != '':
+            dott_runtime_path = env_runtime.strip()
             DottConf.set('DOTTRUNTIME', dott_runtime_path)
 
-            if not os.path.exists(dott_runtime_path):
+            if DottConf._stat(dott_runtime_path) is None:
                 raise ValueError(f'Provided DOTT runtime path ({dott_runtime_path}) does not exist.')
             try:
-                DottConf.dott_runtime = SourceFileLoader('dottruntime', dott_runtime_path + os.sep + 'dottruntime.py').load_module()
-                DottConf.dott_runtime.setup()
+                # the runtime module is only loaded (and set up) once per runtime path
+                if DottConf.dott_runtime is None or DottConf._dott_runtime_path != dott_runtime_path:
+                    DottConf.dott_runtime = SourceFileLoader('dottruntime', dott_runtime_path + os.sep + 'dottruntime.py').load_module()
+                    DottConf.dott_runtime.setup()
+                    DottConf._dott_runtime_path = dott_runtime_path
                 DottConf.set('DOTT_RUNTIME_VER', DottConf.dott_runtime.DOTT_RUNTIME_VER)
             except Exception as ex:
                 raise Exception('Error setting up DOTT runtime.')
@@ -261,87 +510,210 @@ class DottConf:
             raise Exception('Runtime components neither found in DOTT data path nor in DOTTRUNTIME folder.')
 
     @staticmethod
-    def _get_jlink_path(segger_paths: List[str], segger_lib_name: str, jlink_gdb_server_binary: str) -> Tuple[str, str, str]:
-        all_libs = {}
+    def _find_jlink_libs(search_path: str, segger_lib_name: str) -> List[str]:
+        # J-Link libraries are either located directly in the search path (e.g., DOTTJLINKPATH pointing to a J-Link
+        # install folder) or one level below (<Segger folder>/JLink_V???/). Deeper folders are not searched.
+        libs: List[str] = []
+        lib = os.path.join(search_path, segger_lib_name)
+        if os.path.isfile(lib):
+            libs.append(lib)
+        try:
+            with os.scandir(search_path) as it:
+                sub_dirs = [entry.path for entry in it if entry.is_dir(follow_symlinks=False)]
+        except OSError:
+            return libs
+        for sub_dir in sub_dirs:
+            try:
+                with os.scandir(sub_dir) as it:
+                    libs.extend(entry.path for entry in it if entry.name == segger_lib_name and entry.is_file())
+            except OSError:
+                continue
+        return libs
+
+    @staticmethod
+    def _get_jlink_lib_version(lib: str) -> Optional[int]:
+        # Versioned Segger install folders (e.g., JLink_V652d) already tell the version. Only if the folder name does
+        # not (e.g., plain JLink folder on Windows), the library is loaded to query its version.
+        if lib in _jlink_lib_versions:
+            return _jlink_lib_versions[lib]
+
+        m = _JLINK_DIR_VERSION_RE.match(os.path.basename(os.path.dirname(lib)))
+        if m is not None:
+            ver = int(m.group(1)) * 10000 + int(m.group(2)) * 100
+            if m.group(3):
+                ver += ord(m.group(3).lower()) - 0x60
+        else:
+            try:
+                ver = CDLL(lib).JLINKARM_GetDLLVersion()
+            except OSError:
+                # Note: On Linux, Segger provides symlinks in the x86 folder to the 32bit version of the the
+                # JLink library using the 64bit library name. Attempting to load this library on a 64bit system
+                # results in an exception.
+                ver = None
+
+        _jlink_lib_versions[lib] = ver
+        return ver
 
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _locate_jlink(segger_paths: Tuple[str, ...], segger_lib_name: str, jlink_gdb_server_binary: str) -> Tuple[str, int]:
+        # The result is cached in-process (lru_cache) and on disk. The disk cache is keyed by the search paths and
+        # their mtimes (i.e., installing or removing a J-Link version invalidates it) and the cached library is
+        # checked to be unchanged.
+        mtimes: List[Optional[int]] = []
         for search_path in segger_paths:
-            libs = glob.glob(os.path.join(search_path, '**', segger_lib_name), recursive=True)
-
-            for lib in libs:
-                try:
-                    if not os.path.exists(f'{os.path.dirname(lib)}{os.path.sep}{jlink_gdb_server_binary}'):
-                        # Skip dirs which contain a JLINK dll but no GDB server executable (e.g., Ozone install folders).
-                        continue
-                    clib = CDLL(lib)
-                except OSError:
-                    # Note: On Linux, Segger provides symlinks in the x86 folder to the 32bit version of the the
-                    # JLink library using the 64bit library name. Attempting to load this library on a 64bit system
-                    # results in an exception.
+            try:
+                mtimes.append(os.stat(search_path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        key = [list(segger_paths), segger_lib_name, jlink_gdb_server_binary, mtimes]
+
+        try:
+            with open(_JLINK_CACHE_FILE, 'r') as f:
+                cached = json.load(f)
+            if cached['key'] == key and os.stat(cached['lib']).st_mtime_ns == cached['lib_mtime']:
+                return cached['lib'], cached['version']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        all_libs = {}
+        for search_path in segger_paths:
+            for lib in DottConf._find_jlink_libs(search_path, segger_lib_name):
+                if not os.path.exists(f'{os.path.dirname(lib)}{os.path.sep}{jlink_gdb_server_binary}'):
+                    # Skip dirs which contain a JLINK dll but no GDB server executable (e.g., Ozone install folders).
                     continue
-                ver = clib.JLINKARM_GetDLLVersion()
-                all_libs[ver] = lib
-
-        jlink_path: str = ''
-        jlink_version: str = '0'
-        if len(all_libs) > 0:
-            jlink_version = (sorted(all_libs.keys())[-1:])[0]
-            jlink_path = all_libs.get(jlink_version)
-            jlink_path = os.path.dirname(jlink_path)
-
-            #                       6.50   6.50b  6.52   6.52a  6.52b  6.52c
-            known_issue_versions = (65000, 65020, 65200, 65210, 65220, 65230)
-            if jlink_version in known_issue_versions:
-                log.warn(f'The J-Link software with the highest version (in {jlink_path}) has known '
-                         f'issues related to SRAM download and STM32 MCUs. Please upgrade to at least v6.52d')
-        else:
-            raise DottException(f'JLink software (esp. {segger_lib_name}) not found in path {jlink_path}.')
+                ver = DottConf._get_jlink_lib_version(lib)
+                if ver is not None:
+                    all_libs[ver] = lib
+
+        if len(all_libs) == 0:
+            raise DottException(f'JLink software (esp. {segger_lib_name}) not found in path {list(segger_paths)}.')
+        jlink_version: int = sorted(all_libs.keys())[-1]
+        jlink_lib: str = all_libs[jlink_version]
+
+        try:
+            os.makedirs(os.path.dirname(_JLINK_CACHE_FILE), exist_ok=True)
+            with open(_JLINK_CACHE_FILE, 'w') as f:
+                json.dump({'key': key, 'lib': jlink_lib, 'lib_mtime': os.stat(jlink_lib).st_mtime_ns,
+                           'version': jlink_version}, f)
+        except OSError as ex:
+            log.debug(f'Unable to write J-Link cache {_JLINK_CACHE_FILE}: {ex}')
+
+        return jlink_lib, jlink_version
+
+    @staticmethod
+    def _get_jlink_path(segger_paths: List[str], segger_lib_name: str, jlink_gdb_server_binary: str) -> Tuple[str, str, str]:
+        jlink_lib, jlink_version = DottConf._locate_jlink(tuple(segger_paths), segger_lib_name, jlink_gdb_server_binary)
+        jlink_path: str = os.path.dirname(jlink_lib)
+
+        #                       6.50   6.50b  6.52   6.52a  6.52b  6.52c
+        known_issue_versions = (65000, 65020, 65200, 65210, 65220, 65230)
+        if jlink_version in known_issue_versions:
+            log.warn(f'The J-Link software with the highest version (in {jlink_path}) has known '
+                     f'issues related to SRAM download and STM32 MCUs. Please upgrade to at least v6.52d')
         jlink_version = f'{str(jlink_version)[:1]}.{str(jlink_version)[1:3]}{chr(int(str(jlink_version)[-2:]) + 0x60)}'
 
         return jlink_path, segger_lib_name, jlink_version
 
+    @staticmethod
+    def _read_ini(ini_path: str, section: str) -> Dict[str, str]:
+        # If DOTT_CONF_CACHE=1 is set, the items of the DOTT section are cached next to the ini file, keyed by the ini
+        # file's mtime and size. Only the raw ini items are cached; everything derived from them (defaults, paths,
+        # J-Link version) depends on the environment and is still computed on every start.
+        use_cache: bool = os.environ.get('DOTT_CONF_CACHE', '').strip() == '1'
+        cache_path: str = os.path.join(os.path.dirname(ini_path), '.dott.ini.cache')
+        st = DottConf._stat(ini_path)
+        key = [st.st_mtime_ns, st.st_size]
+
+        if use_cache:
+            try:
+                with open(cache_path, 'r') as f:
+                    cached = json.load(f)
+                if cached['key'] == key:
+                    return cached['items']
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+        try:
+            items = _fast_ini_parse(ini_path, section)
+        except ValueError:
+            # fall back to configparser for ini files using features not covered by the fast parser; configparser
+            # is configured to behave like the fast parser (no interpolation, duplicate keys: last one wins)
+            ini = configparser.ConfigParser(interpolation=None, strict=False, empty_lines_in_values=False)
+            ini.read(ini_path)
+            items = dict(ini[section].items()) if ini.has_section(section) else None
+
+        if items is None:
+            raise Exception(f'Unable to find section {section} in {os.path.basename(ini_path)}')
+
+        if use_cache:
+            try:
+                with open(cache_path, 'w') as f:
+                    json.dump({'key': key, 'items': items}, f)
+            except OSError as ex:
+                log.debug(f'Unable to write config cache {cache_path}: {ex}')
+
+        return items
+
+    @staticmethod
+    def _apply_schema(schema: Tuple, summary: List[str]) -> None:
+        # Applies the given config schema (see _CONF_SCHEMA_TARGET) to the in-memory config in a single pass.
+        for key, default, convert, label, log_default in schema:
+            val = DottConf.conf.get(key)
+            if val is None or (isinstance(val, str) and val.strip() == ''):
+                if default is _REQUIRED:
+                    raise Exception(f'{key} not set')
+                val = default(DottConf.conf) if callable(default) else default
+            elif convert is not None:
+                val = convert(val)
+            DottConf.conf[key] = val
+
+            if label is not None and (log_default or val != default):
+                summary.append(label.format(val))
+
     @staticmethod
     def parse_config():
+        # The configuration summary is collected and logged as a single message (also if parsing fails half-way).
+        summary: List[str] = []
+        DottConf._stat_cache = {}
+        try:
+            DottConf._parse_config(summary)
+        finally:
+            DottConf._stat_cache = {}
+            if len(summary) > 0:
+                log.info('\n'.join(summary))
+
+    @staticmethod
+    def _parse_config(summary: List[str]):
         # setup runtime environment
         DottConf._setup_runtime()
-        log.info(f'DOTT runtime:          {DottConf.get("DOTTRUNTIME")}')
-        log.info(f'DOTT runtime version:  {DottConf.get("DOTT_RUNTIME_VER")}')
+        summary.append(f'DOTT runtime:          {DottConf.get("DOTTRUNTIME")}')
+        summary.append(f'DOTT runtime version:  {DottConf.get("DOTT_RUNTIME_VER")}')
 
         # print working directory
-        log.info(f'work directory:        {os.getcwd()}')
+        summary.append(f'work directory:        {os.getcwd()}')
 
         # default ini file
         dott_section = 'DOTT'
         dott_ini = 'dott.ini'
 
         # JLINK gdb server
-        if platform.system() == 'Linux':
-            jlink_default_path = [str(Path('/opt/SEGGER'))]
-            jlink_gdb_server_binary = 'JLinkGDBServerCLExe'
-            jlink_lib_name = 'libjlinkarm.so'
-        else:
-            jlink_default_path = [str(Path('C:/Program Files (x86)/SEGGER')), str(Path('C:/Program Files/SEGGER'))]
-            jlink_gdb_server_binary = 'JLinkGDBServerCL.exe'
-            jlink_lib_name = 'JLink_x64.dll'
+        jlink_default_path, jlink_gdb_server_binary, jlink_lib_name = _JLINK_DEFAULTS
+        jlink_default_path = list(jlink_default_path)
 
         # the DOTTJLINKPATH environment variable overrides the default location of the Segger JLink package
-        if 'DOTTJLINKPATH' in os.environ.keys():
-            log.info(f'Overriding default JLink path ({jlink_default_path}) with DOTTJLINKPATH ({os.environ["DOTTJLINKPATH"]})')
-            jlink_default_path = [os.environ['DOTTJLINKPATH']]
+        env_jlink_path: Optional[str] = os.environ.get('DOTTJLINKPATH')
+        if env_jlink_path is not None:
+            summary.append(f'Overriding default JLink path ({jlink_default_path}) with DOTTJLINKPATH ({env_jlink_path})')
+            jlink_default_path = [env_jlink_path]
 
         # if a dott.ini is found in the working directory then parse it
-        if os.path.exists(os.getcwd() + os.sep + dott_ini):
-            # read ini file
-            ini = configparser.ConfigParser()
-            ini.read(os.getcwd() + os.sep + dott_ini)
-
-            if not ini.has_section(dott_section):
-                raise Exception(f'Unable to find section DOTT in {dott_ini}')
-
+        if DottConf._stat(os.getcwd() + os.sep + dott_ini) is not None:
             # create an in-memory copy of the DOTT section of the init file
-            conf_tmp = dict(ini[dott_section].items())
+            conf_tmp = DottConf._read_ini(os.getcwd() + os.sep + dott_ini, dott_section)
 
         else:
-            log.info(f'No dott.ini found in working directory.')
+            summary.append(f'No dott.ini found in working directory.')
             conf_tmp = {}
 
         # only copy items from ini to in-memory config which are not already present (i.e., set programmatically)
@@ -351,175 +723,51 @@ class DottConf:
 
         # Go through the individual config options and set reasonable defaults
         # where they are missing (or return an error)
-
-        if 'bl_load_elf' not in DottConf.conf:
-            DottConf.conf['bl_load_elf'] = None
-        if DottConf.conf['bl_load_elf'] is not None:
-            if not os.path.exists(DottConf.conf['bl_load_elf']):
-                raise ValueError(f'{DottConf.conf["bl_load_elf"]} does not exist.')
-        log.info(f'BL ELF (load):         {DottConf.conf["bl_load_elf"]}')
-
-        if 'bl_symbol_elf' not in DottConf.conf:
-            # if no symbol file is specified assume that symbols are contained in the load file
-            DottConf.conf['bl_symbol_elf'] = DottConf.conf['bl_load_elf']
-        if DottConf.conf['bl_symbol_elf'] is not None:
-            if not os.path.exists(DottConf.conf['bl_symbol_elf']):
-                raise ValueError(f'{DottConf.conf["bl_symbol_elf"]} does not exist.')
-        log.info(f'BL ELF (symbol):       {DottConf.conf["bl_symbol_elf"]}')
-
-        if 'bl_symbol_addr' not in DottConf.conf:
-            DottConf.conf['bl_symbol_addr'] = 0x0
-        elif DottConf.conf['bl_symbol_addr'].strip() == '':
-            DottConf.conf['bl_symbol_addr'] = 0x0
-        else:
-            DottConf.conf['bl_symbol_addr'] = int(DottConf.conf['bl_symbol_addr'], base=16)
-        log.info(f'BL ADDR (symbol):      0x{DottConf.conf["bl_symbol_addr"]:x}')
-
-        if 'app_load_elf' not in DottConf.conf:
-            raise Exception(f'app_load_elf not set')
-        if not os.path.exists(DottConf.conf['app_load_elf']):
-            raise ValueError(f'{DottConf.conf["app_load_elf"]} does not exist.')
-        log.info(f'APP ELF (load):        {DottConf.conf["app_load_elf"]}')
-
-        if 'app_symbol_elf' not in DottConf.conf:
-            # if no symbol file is specified assume that symbols are contained in the load file
-            DottConf.conf['app_symbol_elf'] = DottConf.conf['app_load_elf']
-        if not os.path.exists(DottConf.conf['app_symbol_elf']):
-            raise ValueError(f'{DottConf.conf["app_symbol_elf"]} does not exist.')
-        log.info(f'APP ELF (symbol):      {DottConf.conf["app_symbol_elf"]}')
-
-        if 'device_name' not in DottConf.conf:
-            DottConf.conf["device_name"] = 'unknown'
-        log.info(f'Device name:           {DottConf.conf["device_name"]}')
-
-        if 'device_endianess' not in DottConf.conf:
-            DottConf.conf['device_endianess'] = 'little'
-        else:
-            if DottConf.conf['device_endianess'] != 'little' and DottConf.conf['device_endianess'] != 'big':
-                raise ValueError(f'device_endianess in {dott_ini} should be either "little" or "big".')
-        log.info(f'Device endianess:      {DottConf.conf["device_endianess"]}')
+        DottConf._apply_schema(_CONF_SCHEMA_TARGET, summary)
 
         # determine J-Link path and version
         jlink_path, jlink_lib_name, jlink_version = DottConf._get_jlink_path(jlink_default_path, jlink_lib_name, jlink_gdb_server_binary)
         DottConf.conf["jlink_path"] = jlink_path
         DottConf.conf["jlink_lib_name"] = jlink_lib_name
         DottConf.conf["jlink_version"] = jlink_version
-        log.info(f'J-LINK local path:     {DottConf.conf["jlink_path"]}')
-        log.info(f'J-LINK local version:  {DottConf.conf["jlink_version"]}')
-
-        # We are connecting to a J-LINK gdb server which was not started by DOTT. Therefore it does not make sense
-        # to print, e.g., SWD connection parameters.
-        if 'jlink_interface' not in DottConf.conf:
-            DottConf.conf['jlink_interface'] = 'SWD'
-        log.info(f'J-LINK interface:      {DottConf.conf["jlink_interface"]}')
-
-        if 'jlink_speed' not in DottConf.conf:
-            DottConf.conf['jlink_speed'] = '15000'
-        log.info(f'J-LINK speed (set):    {DottConf.conf["jlink_speed"]}')
-
-        if 'jlink_serial' not in DottConf.conf:
-            DottConf.conf['jlink_serial'] = None
-        elif DottConf.conf['jlink_serial'] is not None and DottConf.conf['jlink_serial'].strip() == '':
-            DottConf.conf['jlink_serial'] = None
-        if DottConf.conf['jlink_serial'] is not None:
-            log.info(f'J-LINK serial:         {DottConf.conf["jlink_serial"]}')
-
-        if 'gdb_client_binary' not in DottConf.conf:
-            default_gdb = 'arm-none-eabi-gdb-py'
-            DottConf.conf['gdb_client_binary'] = str(Path(f'{os.environ["DOTTGDBPATH"]}/{default_gdb}'))
-        log.info(f'GDB client binary:     {DottConf.conf["gdb_client_binary"]}')
-
-        if 'gdb_server_addr' not in DottConf.conf:
-            DottConf.conf['gdb_server_addr'] = None
-        elif DottConf.conf['gdb_server_addr'].strip() == '':
-            DottConf.conf['gdb_server_addr'] = None
-        else:
-            DottConf.conf['gdb_server_addr'] = DottConf.conf['gdb_server_addr'].strip()
-        log.info(f'GDB server address:    {DottConf.conf["gdb_server_addr"]}')
-
-        if 'gdb_server_port' not in DottConf.conf or DottConf.conf['gdb_server_port'] is None:
-            DottConf.conf['gdb_server_port'] = '2331'
-        elif DottConf.conf['gdb_server_port'].strip() == '':
-            DottConf.conf['gdb_server_port'] = '2331'
-        log.info(f'GDB server port:       {DottConf.conf["gdb_server_port"]}')
-
-        if 'jlink_server_addr' not in DottConf.conf or DottConf.conf['jlink_server_addr'] is None:
-            DottConf.conf['jlink_server_addr'] = None
-        elif DottConf.conf['jlink_server_addr'].strip() == '':
-            DottConf.conf['jlink_server_addr'] = None
-        if DottConf.conf["jlink_server_addr"] != None:
-            log.info(f'JLINK server address:  {DottConf.conf["jlink_server_addr"]}')
-
-        if 'jlink_server_port' not in DottConf.conf or DottConf.conf['jlink_server_port'] is None:
-            DottConf.conf['jlink_server_port'] = '19020'
-        elif DottConf.conf['jlink_server_port'].strip() == '':
-            DottConf.conf['jlink_server_port'] = '19020'
-        if DottConf.conf["jlink_server_port"] != '19020':
-            log.info(f'JLINK server port:     {DottConf.conf["jlink_server_port"]}')
+        summary.append(f'J-LINK local path:     {DottConf.conf["jlink_path"]}')
+        summary.append(f'J-LINK local version:  {DottConf.conf["jlink_version"]}')
+
+        DottConf._apply_schema(_CONF_SCHEMA_CONNECTION, summary)
+
         if DottConf.conf['gdb_server_addr'] is None:
             # no (remote) GDB server address given. try to find a local GDB server binary to launch instead
 
             if 'gdb_server_binary' in DottConf.conf:
-                if not os.path.exists(DottConf.conf['gdb_server_binary']):
+                if DottConf._stat(DottConf.conf['gdb_server_binary']) is None:
                     raise Exception(f'GDB server binary {DottConf.conf["gdb_server_binary"]} ({dott_ini}) not found!')
-            elif os.path.exists(jlink_path):
+            elif DottConf._stat(jlink_path) is not None:
                 DottConf.conf['gdb_server_binary'] = str(Path(f'{jlink_path}/{jlink_gdb_server_binary}'))
             else:
                 # As a last option we check if the GDB server binary is in PATH
-                try:
-                    subprocess.check_call((jlink_gdb_server_binary, '-device'))
-                except subprocess.CalledProcessError:
-                    # Segger gdb server exists and responded with an error since no device was specified
-                    DottConf.conf['gdb_server_binary'] = jlink_gdb_server_binary
-                except Exception as ex:
+                gdb_server_binary: Optional[str] = shutil.which(jlink_gdb_server_binary)
+                if gdb_server_binary is None:
                     raise Exception(f'GDB server binary {jlink_gdb_server_binary} not found! Checked {dott_ini}, '
-                                    'default location and PATH. Giving up.') from None
-            log.info(f'GDB server binary:     {DottConf.conf["gdb_server_binary"]}')
+                                    'default location and PATH. Giving up.')
+                DottConf.conf['gdb_server_binary'] = gdb_server_binary
+            summary.append(f'GDB server binary:     {DottConf.conf["gdb_server_binary"]}')
         else:
-            log.info('GDB server assumed to be already running (not started by DOTT).')
+            summary.append('GDB server assumed to be already running (not started by DOTT).')
             DottConf.conf['gdb_server_binary'] = None
 
-        default_mem_model: TargetMemModel = TargetMemModel.TESTHOOK
-        if 'on_target_mem_model' not in DottConf.conf:
-            DottConf.conf['on_target_mem_model'] = default_mem_model
-        else:
-            DottConf.conf['on_target_mem_model'] = str(DottConf.conf['on_target_mem_model']).upper()
-            if DottConf.conf['on_target_mem_model'] not in TargetMemModel.get_keys():
-                log.warn(f'On-target memory model ({DottConf.conf["on_target_mem_model"]}) from {dott_ini} is unknown. '
-                         f'Falling back to default.')
-                DottConf.conf['on_target_mem_model'] = default_mem_model
-            else:
-                DottConf.conf['on_target_mem_model'] = TargetMemModel[DottConf.conf['on_target_mem_model']]
-
-        on_target_mem_prestack_alloc_size: int = 256
-        if 'on_target_mem_prestack_alloc_size' in DottConf.conf:
-            if str(DottConf.conf['on_target_mem_prestack_alloc_size']).strip() != '':
-                on_target_mem_prestack_alloc_size = int(DottConf.conf['on_target_mem_prestack_alloc_size'])
-        DottConf.conf['on_target_mem_prestack_alloc_size'] = on_target_mem_prestack_alloc_size
-
-        on_target_mem_prestack_alloc_location: str = '_main_init'
-        if 'on_target_mem_prestack_alloc_location' in DottConf.conf:
-            if str(DottConf.conf['on_target_mem_prestack_alloc_location']).strip() != '':
-                on_target_mem_prestack_alloc_location = str(DottConf.conf['on_target_mem_prestack_alloc_location'])
-        DottConf.conf['on_target_mem_prestack_alloc_location'] = on_target_mem_prestack_alloc_location
-
-        on_target_mem_prestack_halt_location: str = 'main'
-        if 'on_target_mem_prestack_halt_location' in DottConf.conf:
-            if str(DottConf.conf['on_target_mem_prestack_halt_location']).strip() != '':
-                on_target_mem_prestack_halt_location = str(DottConf.conf['on_target_mem_prestack_halt_location'])
-        DottConf.conf['on_target_mem_prestack_halt_location'] = on_target_mem_prestack_halt_location
-
-        on_target_mem_prestack_total_stack_size: int = None
-        if 'on_target_mem_prestack_total_stack_size' in DottConf.conf:
-            if str(DottConf.conf['on_target_mem_prestack_total_stack_size']).strip() != '':
-                on_target_mem_prestack_total_stack_size = int(DottConf.conf['on_target_mem_prestack_total_stack_size'])
-        DottConf.conf['on_target_mem_prestack_total_stack_size'] = on_target_mem_prestack_total_stack_size
+        DottConf._apply_schema(_CONF_SCHEMA_MEM, summary)
+        on_target_mem_prestack_alloc_size: int = DottConf.conf['on_target_mem_prestack_alloc_size']
+        on_target_mem_prestack_alloc_location: str = DottConf.conf['on_target_mem_prestack_alloc_location']
+        on_target_mem_prestack_halt_location: str = DottConf.conf['on_target_mem_prestack_halt_location']
+        on_target_mem_prestack_total_stack_size: int = DottConf.conf['on_target_mem_prestack_total_stack_size']
 
         if DottConf.conf['on_target_mem_model'] == TargetMemModel.PRESTACK:
-            log.info(f'Std. target mem model for DOTT default fixtures:  {DottConf.conf["on_target_mem_model"]} '
+            summary.append(f'Std. target mem model for DOTT default fixtures:  {DottConf.conf["on_target_mem_model"]} '
                  f'({on_target_mem_prestack_alloc_size}bytes '
                  f'@{on_target_mem_prestack_alloc_location}; '
                  f'halt @{on_target_mem_prestack_halt_location}; '
                  f'total stack: {on_target_mem_prestack_total_stack_size if on_target_mem_prestack_total_stack_size is not None else "unknown"})')
         else:
-            log.info(f'Std. target mem model for DOTT default fixtures:  {DottConf.conf["on_target_mem_model"]}')
+            summary.append(f'Std. target mem model for DOTT default fixtures:  {DottConf.conf["on_target_mem_model"]}')
+
+        DottConf.cfg = types.SimpleNamespace(**DottConf.conf)
@@ -18,14 +18,18 @@
 # Authors:
 # - Thomas Winkler, ams AG, thomas.winkler@ams.com
 
+import functools
+import logging
+import os
 import traceback
 import types
-from typing import Dict
+import weakref
+from typing import Any, Dict, FrozenSet, Optional, Tuple, Union
 
 import pytest
 
 from dottmi.breakpoint import HaltPoint, InterceptPoint
-from dottmi.dott import DottConf, dott
+from dottmi.dott import DottConf, connect, dott
 from dottmi.dottexceptions import DottException
 from dottmi.pylinkdott import TargetDirect
 from dottmi.target_mem import TargetMemModel, TargetMemTestHook, TargetMem, TargetMemNoAlloc
@@ -33,37 +37,123 @@ from dottmi.utils import log
 
 
 # ----------------------------------------------------------------------------------------------------------------------
-def target_load_common(name: str, load_to_flash: bool, silent: bool = False, dt: 'Target' = None) -> None:
+# Downloads (and symbol loads) which were performed per target. Used to skip downloads of unchanged images.
+_loaded_images: 'weakref.WeakKeyDictionary[Target, Tuple]' = weakref.WeakKeyDictionary()
+_loaded_symbols: 'weakref.WeakKeyDictionary[Target, Tuple]' = weakref.WeakKeyDictionary()
+
+
+def _file_key(file_name: Optional[str]) -> Tuple:
+    # identifies a file by its name and modification time
+    if file_name is None:
+        return None, None
+    return file_name, os.stat(file_name).st_mtime_ns
+
+
+@functools.lru_cache(maxsize=1)
+def _resolved_load_conf() -> types.SimpleNamespace:
+    # config items related to target download are fixed for a test session and hence only resolved once
+    return types.SimpleNamespace(bl_load_elf=DottConf.get('bl_load_elf'),
+                                 bl_symbol_elf=DottConf.get('bl_symbol_elf'),
+                                 bl_symbol_addr=int(DottConf.get('bl_symbol_addr')),
+                                 app_load_elf=DottConf.get('app_load_elf'),
+                                 app_symbol_elf=DottConf.get('app_symbol_elf'))
+
+
+@functools.lru_cache(maxsize=None)
+def _resolved_prestack_conf(mem_model_args: FrozenSet[Tuple[str, Any]]) -> types.SimpleNamespace:
+    # PRESTACK settings from config, overridden by the arguments of the dott_mem marker (if any); resolved once per
+    # distinct set of marker arguments
+    args: Dict = dict(mem_model_args)
+    conf = types.SimpleNamespace(num_bytes=DottConf.conf['on_target_mem_prestack_alloc_size'],
+                                 alloc_location=DottConf.conf['on_target_mem_prestack_alloc_location'],
+                                 halt_location=DottConf.conf['on_target_mem_prestack_halt_location'],
+                                 total_stack_num_bytes=DottConf.conf['on_target_mem_prestack_total_stack_size'],
+                                 override=False)
+
+    # override default value of on-target memory size
+    if 'alloc_size' in args:
+        conf.num_bytes = int(args['alloc_size'])
+        conf.override = True
+    if conf.num_bytes % 4 != 0:
+        raise DottException('The num_bytes argument for prestack memory allocation shall be a multiple of 4!')
+
+    # override default value for target alloc location
+    if 'alloc_location' in args:
+        conf.alloc_location = str(args['alloc_location'])
+        conf.override = True
+
+    # override default value for target halt location
+    if 'halt_location' in args:
+        conf.halt_location = str(args['halt_location'])
+        conf.override = True
+
+    # override default value for target total_stack_size
+    if 'total_stack_size' in args:
+        conf.total_stack_num_bytes = args['total_stack_size']
+        conf.override = True
+
+    return conf
+
+
+def _force_reload(request) -> bool:
+    return request.node.get_closest_marker('dott_force_reload') is not None
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+def target_load_common(name: str, load_to_flash: bool, silent: bool = False, dt: 'Target' = None,
+                       force: bool = True) -> None:
+    """
+    Downloads the application (and optionally the bootloader) to the target.
+
+    Args:
+        name: Name of the download destination (used for log output only).
+        load_to_flash: Whether the images are downloaded to FLASH or to SRAM.
+        silent: If True, no informative output is printed.
+        dt: Target to download to (default: DOTT's default target).
+        force: If False, the download is skipped if the same (unchanged) images were already downloaded to FLASH
+               before. Downloads to SRAM are always performed.
+    """
     dt = dott().target if dt is None else dt
     if dt is None:
         log.error('Connection to target (via JLINK) was not properly established. Please check your JLINK parameters!')
         pytest.exit('Aborting test execution.')
 
     try:
-        if not silent:
-            log.info(f'Triggering download of APP to {name}...')
+        conf = _resolved_load_conf()
+        load_key = (load_to_flash,
+                    _file_key(conf.bl_load_elf),
+                    _file_key(conf.app_load_elf),
+                    _file_key(conf.app_symbol_elf),
+                    _file_key(conf.bl_symbol_elf))
+        if not force and load_to_flash and _loaded_images.get(dt) == load_key:
+            if not silent and log.isEnabledFor(logging.INFO):
+                log.info('APP already downloaded to %s. Skipping download.', name)
+            return
+
+        if not silent and log.isEnabledFor(logging.INFO):
+            log.info('Triggering download of APP to %s...', name)
 
         # optionally load bootloader binary (load elf ONLY - symbols are loaded after the app)
-        bl_load_elf = DottConf.get('bl_load_elf')
-        if bl_load_elf is not None:
-            dt.load(bl_load_elf, None, enable_flash=load_to_flash)
+        if conf.bl_load_elf is not None:
+            dt.load(conf.bl_load_elf, None, enable_flash=load_to_flash)
 
         # load application binaries
-        app_load_elf = DottConf.get('app_load_elf')
-        app_symbol_elf = DottConf.get('app_symbol_elf')
-        if app_load_elf is not None:
-            dt.load(app_load_elf, app_symbol_elf, enable_flash=load_to_flash)
+        if conf.app_load_elf is not None:
+            dt.load(conf.app_load_elf, conf.app_symbol_elf, enable_flash=load_to_flash)
+            _loaded_symbols[dt] = load_key[3]
 
+        cmds = []
         # add bootloader symbol file; note: it is important to this 'add' so after doing target.load() with symbol elf.
-        bl_symbol_elf = DottConf.get('bl_symbol_elf')
-        if bl_symbol_elf is not None:
-            dt.cli_exec('add-symbol-file %s 0x%x' % (DottConf.get('bl_symbol_elf'),
-                                                                int(DottConf.get('bl_symbol_addr'))))
+        if conf.bl_symbol_elf is not None:
+            cmds.append('add-symbol-file %s 0x%x' % (conf.bl_symbol_elf, conf.bl_symbol_addr))
 
         # disable FLASH breakpoints
-        dt.cli_exec('monitor flash breakpoints=0')
-    except Exception as ex:
-        log.exception(str(ex))
+        cmds.append('monitor flash breakpoints=0')
+        dt.cli_exec_many(cmds)
+
+        _loaded_images[dt] = load_key
+    except Exception:
+        log.exception('Target download failed')
         pytest.exit('Unhandled exception target download. See trace above.')
 
 
@@ -82,9 +172,11 @@ def target_load_sram() -> None:
 def target_load_flash(silent: bool = False) -> None:
     """
     This fixture loads the application (and optionally the bootloader) binary onto the target FLASH. This fixture has
-    SECCION scope and hence is execute once per test session and not for every test where it is specified.
+    SECCION scope and hence is execute once per test session and not for every test where it is specified. The download
+    is skipped if the same (unchanged) images have already been downloaded to FLASH in this session. Being session
+    scoped, this fixture does not consider the 'dott_force_reload' marker; use target_load_flash_always instead.
     """
-    target_load_common('FLASH', load_to_flash=True, silent=silent)
+    target_load_common('FLASH', load_to_flash=True, silent=silent, force=False)
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -103,35 +195,60 @@ def target_load_flash_always(silent: bool = False) -> None:
 
 # ----------------------------------------------------------------------------------------------------------------------
 @pytest.fixture(scope='function')
-def target_load_symbols_only(silent: bool = False) -> None:
+def target_load_symbols_only(request, silent: bool = False) -> None:
     """
     This fixture loads the symbols from the app_symbol_elf file but does NOT perform actual target download. Hence,
     this fixture is useful if the code has already been loaded onto the target before and only symbol information
-    is needed in the test.
+    is needed in the test. Loading is skipped if the same (unchanged) symbol file is already loaded unless the test
+    is marked with 'dott_force_reload'.
     """
-    app_symbol_elf = DottConf.get('app_symbol_elf')
-    dott().target.load(None, app_symbol_elf, enable_flash=False)
+    dt = dott().target
+    app_symbol_elf = _resolved_load_conf().app_symbol_elf
+    symbols_key = _file_key(app_symbol_elf)
+    if not _force_reload(request) and _loaded_symbols.get(dt) == symbols_key:
+        return
+    dt.load(None, app_symbol_elf, enable_flash=False)
+    _loaded_symbols[dt] = symbols_key
 
 
 # ----------------------------------------------------------------------------------------------------------------------
-def _target_mem_init_noalloc(dt: 'Target' = None) -> None:
-    dt = dott().target if dt is None else dt
+def _run_to(dt: 'Target', location: Union[str, HaltPoint], delete: bool = True, timeout: float = 5) -> HaltPoint:
+    """
+    Lets the target run until the given location is reached. If the location is not reached within the timeout the
+    target is halted and a warning is issued.
 
-    # print mem model override information
-    if DottConf.conf['on_target_mem_model'] != TargetMemModel.NOALLOC:
-        log.info(f'Overriding std. target mem model with {TargetMemModel.NOALLOC}.')
+    Args:
+        dt: Target to run.
+        location: Location to run to or an existing HaltPoint to be re-used.
+        delete: If True, the breakpoint is deleted once the target has halted.
+        timeout: Time (in seconds) to wait for the location to be reached.
 
-    # define the initial test breakpoint, start the target and wait until the breakpoint is reached
-    bp = HaltPoint('main')
+    Returns: The breakpoint used to halt the target.
+    """
+    bp = HaltPoint(location, target=dt) if isinstance(location, str) else location
     dt.cont()
     try:
-        bp.wait_complete(timeout=5)
+        bp.wait_complete(timeout=timeout)
     except Exception:
         dt.halt()
-        log.warn('main not reached. Target halted after timeout at PC: 0x%x' % dt.eval('$pc'))
+        if log.isEnabledFor(logging.WARNING):
+            # note: reading the PC is a GDB round-trip; skip it if the warning would be discarded anyway
+            log.warn('%s not reached. Target halted after timeout at PC: 0x%x', bp.get_location(), dt.eval('$pc'))
+    finally:
+        if delete:
+            bp.delete()
+    return bp
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+def _target_mem_init_noalloc(dt: 'Target') -> None:
+
+    # print mem model override information
+    if DottConf.conf['on_target_mem_model'] != TargetMemModel.NOALLOC:
+        log.info(f'Overriding std. target mem model with {TargetMemModel.NOALLOC}.')
 
-    # remove test hook breakpoint
-    bp.delete()
+    # run to the initial test breakpoint
+    _run_to(dt, 'main')
 
     # once we have reached the initial breakpoint we initialize the on-target memory access model
     dt.mem = TargetMemNoAlloc(dt)
@@ -140,24 +257,14 @@ def _target_mem_init_noalloc(dt: 'Target' = None) -> None:
 
 
 # ----------------------------------------------------------------------------------------------------------------------
-def _target_mem_init_testhook(dt: 'Target' = None) -> None:
-    dt = dott().target if dt is None else dt
+def _target_mem_init_testhook(dt: 'Target') -> None:
 
     # print mem model override information
     if DottConf.conf['on_target_mem_model'] != TargetMemModel.TESTHOOK:
         log.info(f'Overriding std. target mem model with {TargetMemModel.TESTHOOK}.')
 
-    # define the initial test breakpoint, start the target and wait until the breakpoint is reached
-    bp = HaltPoint('DOTT_test_hook_chained')
-    dt.cont()
-    try:
-        bp.wait_complete(timeout=5)
-    except Exception:
-        dt.halt()
-        log.warn('DOTT_test_hook_chained not reached. Target halted after timeout at PC: 0x%x' % dt.eval('$pc'))
-
-    # remove test hook breakpoint
-    bp.delete()
+    # run to the initial test breakpoint
+    _run_to(dt, 'DOTT_test_hook_chained')
 
     # once we have reached the initial breakpoint we initialize the on-target memory access model
     dt.mem = TargetMemTestHook(dt)
@@ -166,76 +273,76 @@ def _target_mem_init_testhook(dt: 'Target' = None) -> None:
 
 
 # ----------------------------------------------------------------------------------------------------------------------
-def _target_mem_init_prestack(mem_model_args: Dict = None, dt: 'Target' = None) -> None:
-    dt = dott().target if dt is None else dt
+def _target_mem_init_prestack(dt: 'Target', mem_model_args: Dict = None) -> None:
     canary_word = 0xabad1dea
-    override = False
 
-    # override default value of on-target memory size
-    target_mem_num_bytes: int = DottConf.conf['on_target_mem_prestack_alloc_size']
-    if mem_model_args is not None and 'alloc_size' in mem_model_args:
-        target_mem_num_bytes = int(mem_model_args['alloc_size'])
-        override = True
-    if target_mem_num_bytes % 4 != 0:
-        raise DottException('The num_bytes argument for prestack memory allocation shall be a multiple of 4!')
-
-    # override default value for target alloc location
-    alloc_location: str = DottConf.conf['on_target_mem_prestack_alloc_location']
-    if mem_model_args is not None and 'alloc_location' in mem_model_args:
-        alloc_location = str(mem_model_args['alloc_location'])
-        override = True
-
-    # override default value for target halt location
-    halt_location: str = DottConf.conf['on_target_mem_prestack_halt_location']
-    if mem_model_args is not None and 'halt_location' in mem_model_args:
-        halt_location = str(mem_model_args['halt_location'])
-        override = True
-
-    # override default value for target total_stack_size
-    total_stack_num_bytes: int = DottConf.conf['on_target_mem_prestack_total_stack_size']
-    if mem_model_args is not None and 'total_stack_size' in mem_model_args:
-        total_stack_num_bytes = mem_model_args['total_stack_size']
-        override = True
+    conf = _resolved_prestack_conf(frozenset(mem_model_args.items()) if mem_model_args is not None else frozenset())
+    target_mem_num_bytes: int = conf.num_bytes
+    alloc_location: str = conf.alloc_location
+    halt_location: str = conf.halt_location
+    total_stack_num_bytes: int = conf.total_stack_num_bytes
 
     # print mem model override information
-    if override:
+    if conf.override:
         log.info(f'Overriding std. target mem model with {TargetMemModel.PRESTACK}'
                  f'({target_mem_num_bytes}bytes '
                  f'@{alloc_location}; '
                  f'halt @{halt_location}; '
                  f'total stack: {total_stack_num_bytes if total_stack_num_bytes is not None else "unknown"}).')
 
-    # define the initial allocation breakpoint, start the target and wait until the breakpoint is reached
-    bp = HaltPoint(alloc_location)
-    dt.cont()
-    try:
-        bp.wait_complete(timeout=5)
-    except Exception:
-        dt.halt()
-        log.warn(f'{alloc_location} not reached. Target halted after timeout at PC: 0x{dt.eval("$pc"):x}')
-    bp.delete()
+    # run to the allocation location; the breakpoint is kept if it is also used as halt location
+    reuse_bp = halt_location == alloc_location
+    bp = _run_to(dt, alloc_location, delete=not reuse_bp)
 
-    # adjust the stack pointer (i.e., steal the requested amount of on-target memory)
-    dt.eval(f'$sp -= {target_mem_num_bytes}')
+    # adjust the stack pointer (i.e., steal the requested amount of on-target memory) and read back the new value
+    _, target_mem_stack_start = dt.eval_batch([f'$sp -= {target_mem_num_bytes}', '$sp'])
 
     # initialize the on-target memory access model using the 'stolen' memory
-    target_mem_stack_start = dt.eval('$sp')
     dt.mem = TargetMem(dt, target_mem_stack_start, target_mem_num_bytes)
 
-    # define the halt breakpoint, start the target and wait until the breakpoint is reached
-    bp = HaltPoint(halt_location)
-    dt.cont()
-    try:
-        bp.wait_complete(timeout=5)
-    except Exception:
-        dt.halt()
-        log.warn(f'{halt_location} not reached. Target halted after timeout at PC: 0x{dt.eval("$pc"):x}')
-    bp.delete()
+    # run to the halt location
+    _run_to(dt, bp if reuse_bp else halt_location)
 
     # pass control to test
     yield
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+# Memory model initializers; called with target and dott_mem marker arguments (None if there is no marker).
+_MEM_MODEL_INIT = {
+    TargetMemModel.NOALLOC: lambda dt, mem_model_args: _target_mem_init_noalloc(dt),
+    TargetMemModel.TESTHOOK: lambda dt, mem_model_args: _target_mem_init_testhook(dt),
+    TargetMemModel.PRESTACK: _target_mem_init_prestack,
+}
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Per-item stash for the (memory model, marker arguments) of the item's dott_mem marker (None if there is no marker).
+# note: pytest versions before 7.0 do not provide an item stash; a private item attribute is used instead
+_DOTT_MEM_KEY = pytest.StashKey[Optional[Tuple[TargetMemModel, Dict]]]() if hasattr(pytest, 'StashKey') else None
+_DOTT_MEM_ATTR = '_dott_mem_marker'
+
+
+def _resolve_dott_mem_marker(item) -> Optional[Tuple[TargetMemModel, Dict]]:
+    for m in item.iter_markers('dott_mem'):
+        if 'model' in m.kwargs:
+            return m.kwargs['model'], m.kwargs
+    return None
+
+
+def _dott_mem_marker(item) -> Optional[Tuple[TargetMemModel, Dict]]:
+    # note: the stash is filled at collection time if the hooks of this module are active (i.e., conftest does
+    # 'from dottmi.fixtures import *'); otherwise the marker is resolved here on first use
+    if _DOTT_MEM_KEY is None:
+        if not hasattr(item, _DOTT_MEM_ATTR):
+            setattr(item, _DOTT_MEM_ATTR, _resolve_dott_mem_marker(item))
+        return getattr(item, _DOTT_MEM_ATTR)
+
+    if _DOTT_MEM_KEY not in item.stash:
+        item.stash[_DOTT_MEM_KEY] = _resolve_dott_mem_marker(item)
+    return item.stash[_DOTT_MEM_KEY]
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 def target_reset_common(request, sp: str = None, pc: str = None, setup_cb: types.FunctionType = None, dt: 'Target' = None) -> None:
     dt = dott().target if dt is None else dt
@@ -257,21 +364,15 @@ def target_reset_common(request, sp: str = None, pc: str = None, setup_cb: types
     # set on-target memory allocation model either from config or from pytest marker
     mem_model: TargetMemModel = DottConf.conf['on_target_mem_model']
     mem_model_args = None
-    if 'pytestmark' in request.keywords:
-        for m in request.keywords['pytestmark']:
-            if m.name == 'dott_mem' and 'model' in m.kwargs:
-                mem_model = m.kwargs['model']
-                mem_model_args = m.kwargs
-                break
-
-    if mem_model == TargetMemModel.NOALLOC:
-        yield from _target_mem_init_noalloc()
-    elif mem_model == TargetMemModel.TESTHOOK:
-        yield from _target_mem_init_testhook()
-    elif mem_model == TargetMemModel.PRESTACK:
-        yield from _target_mem_init_prestack(mem_model_args)
-    else:
+    marker = _dott_mem_marker(request.node)
+    if marker is not None:
+        mem_model, mem_model_args = marker
+
+    mem_init = _MEM_MODEL_INIT.get(mem_model)
+    if mem_init is None:
         log.warn(f'Selected target memory allocation model is not implemented!')
+        return
+    yield from mem_init(dt, mem_model_args)
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -303,10 +404,12 @@ def target_reset_flash(request) -> None:
 
 
 # ----------------------------------------------------------------------------------------------------------------------
-@pytest.fixture(scope='function')
+@pytest.fixture(scope='session')
 def live_access():
     """
-    This fixture provides access to target memory while the target is running.
+    This fixture provides access to target memory while the target is running. The underlying J-Link connection is
+    established once and shared by all tests of the session. Tests which require a dedicated connection shall use
+    live_access_fresh instead.
 
     Returns: Instance of TargetLive which provides memory read/write functions while target is running.
     """
@@ -315,6 +418,19 @@ def live_access():
     live.disconnect()
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+@pytest.fixture(scope='function')
+def live_access_fresh():
+    """
+    Same as live_access but with a J-Link connection which is established for (and closed after) the current test.
+
+    Returns: Instance of TargetLive which provides memory read/write functions while target is running.
+    """
+    live = TargetDirect(DottConf.conf['device_name'], pooled=False)
+    yield live
+    live.disconnect()
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 # DOTT-internal fixture which performs DOTT related cleanup on a per-function basis
 @pytest.fixture(scope='function', autouse=True)
@@ -330,7 +446,7 @@ def dott_auto_func_cleanup():
 @pytest.fixture(scope='session', autouse=True)
 def dott_auto_connect_and_disconnect():
     try:
-        dott()
+        connect()
     except Exception:
         log.error(traceback.format_exc(limit=None))
         pytest.exit('DOTT failed to initialize. Check exception trace for details.')
@@ -344,6 +460,20 @@ def dott_auto_connect_and_disconnect():
         dott().shutdown()
 
 
+def pytest_sessionstart(session):
+    # config might differ between test sessions (e.g., when running pytest in-process multiple times)
+    _resolved_load_conf.cache_clear()
+    _resolved_prestack_conf.cache_clear()
+
+
+def pytest_collection_modifyitems(session, config, items):
+    # resolve dott_mem markers once at collection time instead of on every target reset
+    for item in items:
+        _dott_mem_marker(item)
+
+
 def pytest_configure(config):
     # register markers with pytest
     config.addinivalue_line("markers", "dott_mem: marker to select on-target memory allocation model")
+    config.addinivalue_line("markers", "dott_force_reload: marker to force target_load_symbols_only to reload an "
+                                       "otherwise cached symbol file")
@@ -18,17 +18,16 @@
 # Authors:
 # - Thomas Winkler, ams AG, thomas.winkler@ams.com
 
-import atexit
 import os
 import platform
 import signal
 import subprocess
 import time
+import weakref
 from abc import ABC, abstractmethod
 from pathlib import Path
 
 import psutil
-from psutil import NoSuchProcess
 
 import dottmi.target
 from dottmi.dottexceptions import DottException
@@ -37,6 +36,21 @@ from dottmi.gdbcontrollerdott import GdbControllerDott
 from dottmi.utils import log
 
 
+def _popen_del(instance):
+    try:
+        instance.__del_orig__()
+    except:
+        pass
+
+
+# Popen.__del__ occasionally complains under Windows about invalid file handles on interpreter shutdown. This is
+# somewhat distracting and is silenced by a custom delete function. Note: This also covers the Popen instance used
+# by pygdbmi for the GDB client. The patch is applied only once (i.e., not per GDB server instance).
+if not hasattr(subprocess.Popen, '__del_orig__'):
+    subprocess.Popen.__del_orig__ = subprocess.Popen.__del__
+    subprocess.Popen.__del__ = _popen_del
+
+
 class GdbServer(ABC):
     def __init__(self, addr, port, device_id):
         self._addr: str = addr
@@ -64,32 +78,84 @@ class GdbServer(ABC):
         pass
 
 
+def _shutdown_srv_process(srv_process: subprocess.Popen) -> None:
+    # if the gdb server is still running (despite being started in single run mode) it is terminated here
+    try:
+        if platform.system() == 'Windows':
+            srv_process.send_signal(signal.CTRL_BREAK_EVENT)
+        else:
+            srv_process.send_signal(signal.SIGINT)
+        srv_process.wait(timeout=1)
+    except subprocess.TimeoutExpired:
+        srv_process.terminate()
+        try:
+            srv_process.wait(timeout=.5)
+        except subprocess.TimeoutExpired:
+            pass
+
+
+# J-Link GDB server exit codes and their meaning
+_JLINK_ERRORS = {
+    0: 'No error. Gdb server closed normally.',
+    -1: 'Unknown error. Should not happen.',
+    -2: 'Failed to open listener port (default: 2331, current: %d).',
+    -3: 'Could not connect to target. No target voltage detected or connection failed.',
+    -4: 'Failed to accept a connection from GDB.',
+    -5: 'Failed to parse the command line options, wrong or missing command line parameter.',
+    -6: 'Unknown or no device name set.',
+    -7: 'Failed to connect to J-Link.',
+}
+
+
+def _port_listening_procfs(pid: int, port: int) -> bool:
+    # Linux only: checks if the process with the given pid has a socket in LISTEN state on the given local port.
+    # The listening sockets are taken from the kernel's TCP socket tables and matched (by inode) against the
+    # file descriptors of the process.
+    inodes = set()
+    for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(table, 'r') as f:
+                next(f)  # skip header line
+                for line in f:
+                    fields = line.split()
+                    # fields[1]: local address as <hex ip>:<hex port>; fields[3]: socket state (0A = LISTEN);
+                    # fields[9]: inode
+                    if fields[3] == '0A' and int(fields[1].rsplit(':', 1)[1], 16) == port:
+                        inodes.add(f'socket:[{fields[9]}]')
+        except OSError:
+            pass  # e.g., no IPv6 support
+    if len(inodes) == 0:
+        return False
+
+    fd_dir = f'/proc/{pid}/fd'
+    try:
+        for fd in os.listdir(fd_dir):
+            try:
+                if os.readlink(os.path.join(fd_dir, fd)) in inodes:
+                    return True
+            except OSError:
+                pass  # fd closed in the meantime
+    except OSError:
+        pass  # process terminated (detected by the caller)
+    return False
+
+
 class GdbServerJLink(GdbServer):
     def __init__(self, gdb_svr_binary: str, addr: str, port: int, device_id: str, interface: str, endian: str,
                  speed: str = '15000', serial_number: str = None, jlink_addr: str = None):
         super().__init__(addr, port, device_id)
         self._srv_binary: str = gdb_svr_binary
         self._srv_process = None
+        self._srv_finalizer: weakref.finalize = None
         self._target_interface: str = interface
         self._target_endian: str = endian
         self._speed: str = speed
         self._serial_number: str = serial_number
         self._jlink_addr: str = jlink_addr
-        # Popen.__del__ occasionally complains under Windows about invalid file handles on interpreter shutdown.
-        # This is somewhat distracting and is silenced by a custom delete function.
-        subprocess.Popen.__del_orig__ = subprocess.Popen.__del__
-        subprocess.Popen.__del__ = GdbServerJLink._popen_del
 
         if self.addr is None:
             self._launch()
 
-    @staticmethod
-    def _popen_del(instance):
-        try:
-            instance.__del_orig__()
-        except:
-            pass
-
     def _launch_internal(self):
         args = [self._srv_binary, '-device', self.device_id, '-if', self._target_interface , '-endian',
                 self._target_endian, '-vd', '-noir', '-timeout', '2000', '-singlerun', '-silent', '-speed',
@@ -112,97 +178,102 @@ class GdbServerJLink(GdbServer):
         self._srv_process = subprocess.Popen(args, shell=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
                                              creationflags=cflags)
 
-        p = psutil.Process(self._srv_process.pid)
+        # wait until the started process has opened a listening socket on the expected port
         startup_done = False
-        try:
-            # query the started process until it has opened a listening socket on the expected port
-            end_time = time.time() + 8
-            while not startup_done and time.time() < end_time:
-                for c in p.connections():
-                    if c.laddr.port == self.port:
-                        if self._serial_number is None:
-                            log.info(f'GDB server is now listening on port {self.port}!')
-                        else:
-                            log.info(f'GDB server (JLINK SN: {self._serial_number}) now listening on port {self.port}!')
-                        startup_done = True
-
-        except psutil.AccessDenied as ex:
-            # On Linux the situation was observed that from newly launched GDB server processes
-            # an AccessDenied exception is raised when accessing them with psutils. This exception
-            # is then 'thrown' upwards where it is handled by retrying to create the process.
-            raise ex
-
-        except (NoSuchProcess, PermissionError) as ex:
-            log.error('JLINK GDB server has terminated!')
-            end_time = time.time() + 2
-            res_poll = None
-            while not startup_done and time.time() < end_time:
-                res_poll = self._srv_process.poll()
-                if res_poll is not None:
-                    break
+        end_time = time.monotonic() + 8
+        while time.monotonic() < end_time:
+            if self._srv_process.poll() is not None:
+                break
+            if self._port_listening():
+                startup_done = True
+                break
+            time.sleep(0.02)
+
+        if not startup_done:
+            res_poll = self._srv_process.poll()
             if res_poll is not None:
-                err_code, err_str = self._conv_jlink_error(self._srv_process.poll())
+                log.error('JLINK GDB server has terminated!')
+                err_code, err_str = self._conv_jlink_error(res_poll)
                 log.error(f'J-Link gdb server termination reason: {err_code:x} ({err_str})')
                 if err_code == -2:
                     log.error('Already a JLINK GDB server instance running?')
                 if err_code == -5:
                     log.debug('GDB server command line:')
                     log.debug(' '.join(args))
-            raise DottException('Startup of JLINK gdb server failed!') from None
-
-        if not startup_done:
+                raise DottException('Startup of JLINK gdb server failed!') from None
             raise DottException('Startup of JLINK gdb server failed due to timeout!') from None
+
+        if self._serial_number is None:
+            log.info(f'GDB server is now listening on port {self.port}!')
         else:
-            self._addr = '127.0.0.1'
-            atexit.register(self.shutdown)
+            log.info(f'GDB server (JLINK SN: {self._serial_number}) now listening on port {self.port}!')
+        self._addr = '127.0.0.1'
+        # note: the finalizer is also called at interpreter exit
+        self._srv_finalizer = weakref.finalize(self, _shutdown_srv_process, self._srv_process)
+
+    def _port_listening(self) -> bool:
+        # Checks if the launched GDB server process has opened its listening socket without touching the port. Note:
+        # Binding to the port for probing could make the GDB server's own bind fail (i.e., the GDB server exits with
+        # error -2). Probing by connecting to the port is not an option either since the GDB server is running in single
+        # run mode and would terminate once the probing connection is closed. Only sockets of the launched process are
+        # considered such that another process holding the port is not mistaken for a successful startup.
+        if platform.system() == 'Linux':
+            return _port_listening_procfs(self._srv_process.pid, self.port)
+        try:
+            conns = psutil.Process(self._srv_process.pid).connections(kind='tcp')
+        except (psutil.AccessDenied, psutil.NoSuchProcess):
+            return False  # process terminated (detected by the caller) or not yet accessible
+        return any(c.laddr.port == self.port and c.status == psutil.CONN_LISTEN for c in conns)
 
     def _launch(self):
-        start_done: bool = False
-        while not start_done:
-            try:
-                self._launch_internal()
-                start_done = True
-            except psutil.AccessDenied as ex:
-                pass
+        self._launch_internal()
 
     def shutdown(self):
         if self._srv_process is not None:
-            # if the gdb server is still running (despite being started in single run mode) it is terminated here
-            try:
-                if platform.system() == 'Windows':
-                    os.kill(self._srv_process.pid, signal.CTRL_BREAK_EVENT)
-                else:
-                    os.kill(self._srv_process.pid, signal.SIGINT)
-                self._srv_process.communicate(timeout=1)
-            except subprocess.TimeoutExpired:
-                self._srv_process.terminate()
+            if self._srv_finalizer is not None:
+                self._srv_finalizer()
+            else:
+                _shutdown_srv_process(self._srv_process)
             self._srv_process = None
 
     def _conv_jlink_error(self, jlink_error: int) -> (int, str):
         bits_in_word = 32
         err_code = jlink_error - (1 << bits_in_word)
 
-        err_str = 'Unknown error code.'
-        if err_code == 0:
-            err_str = 'No error. Gdb server closed normally.'
-        if err_code == -1:
-            err_str = 'Unknown error. Should not happen.'
+        err_str = _JLINK_ERRORS.get(err_code, 'Unknown error code.')
         if err_code == -2:
-            err_str = f'Failed to open listener port (default: 2331, current: {self.port}).'
-        if err_code == -3:
-            err_str = 'Could not connect to target. No target voltage detected or connection failed.'
-        if err_code == -4:
-            err_str = 'Failed to accept a connection from GDB.'
-        if err_code == -5:
-            err_str = 'Failed to parse the command line options, wrong or missing command line parameter.'
-        if err_code == -6:
-            err_str = 'Unknown or no device name set.'
-        if err_code == -7:
-            err_str = 'Failed to connect to J-Link.'
+            err_str = err_str % self.port
 
         return err_code, err_str
 
 
+_gdb_env_initialized: bool = False
+
+
+def _setup_gdb_env() -> None:
+    # Set Python 2.7 (used for GDB commands) path such that gdb subprocess actually finds it. Note: pygdbmi does not
+    # allow to pass an environment to the gdb subprocess. Hence, the process environment is adjusted. This is done
+    # only once such that PATH does not grow with every GdbClient instance.
+    global _gdb_env_initialized
+    if _gdb_env_initialized:
+        return
+
+    python27_path = os.environ.get('PYTHONPATH27')
+    if python27_path is None:
+        raise Exception('PYTHONPATH27 not set. Can not load gdb command support. Aborting.')
+    if platform.system() == 'Windows':
+        os.environ['PATH'] = os.pathsep.join([python27_path, os.environ['PATH']])
+        python_path = [python27_path, f'{python27_path}\\lib', f'{python27_path}\\lib\\site-packages',
+                       f'{python27_path}\\DLLs']
+    else:
+        python_path = ['']
+
+    my_dir = os.path.dirname(os.path.realpath(__file__))
+    python_path.append(str(Path(my_dir + '/..')))
+    os.environ['PYTHONPATH'] = os.pathsep.join(python_path)
+    _gdb_env_initialized = True
+
+
 class GdbClient(object):
 
     # Create a new gdb instance
@@ -213,20 +284,7 @@ class GdbClient(object):
         self._gdb_client_binary: str = gdb_client_binary
         self._mi_controller: GdbControllerDott = None
         self._gdb_mi: GdbMi = None
-
-        # set Python 2.7 (used for GDB commands) path such that gdb subprocess actually finds it
-        my_env = os.environ.copy()
-        python27_path = os.environ.get('PYTHONPATH27')
-        if python27_path is None:
-            raise Exception('PYTHONPATH27 not set. Can not load gdb command support. Aborting.')
-        if platform.system() == 'Windows':
-            os.environ['PATH'] = f'{python27_path};{my_env["PATH"]}'
-            os.environ['PYTHONPATH'] = '%s;%s\\lib;%s\\lib\\site-packages;%s\\DLLs' % ((python27_path,) * 4)
-        else:
-            os.environ['PYTHONPATH'] = ''
-
-        my_dir = os.path.dirname(os.path.realpath(__file__))
-        os.environ['PYTHONPATH'] += os.pathsep + str(Path(my_dir + '/..'))
+        _setup_gdb_env()
 
     # connect to already running gdb server
     def connect(self) -> None:
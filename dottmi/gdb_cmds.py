@@ -18,14 +18,25 @@
 # Authors:
 # - Thomas Winkler, ams AG, thomas.winkler@ams.com
 
-import json
-
 import gdb
 
-from dottmi.gdb_shared import BpMsg, BpSharedConf
+from dottmi.gdb_shared import BpCmdList, BpMsg, BpSharedConf
+
+# messages without payload are serialized only once
+_HIT_BYTES = BpMsg(BpMsg.MSG_TYPE_HIT).serialize()
+_RESP_BYTES = BpMsg(BpMsg.MSG_TYPE_RESP).serialize()
+
+# types of eval results which can not be converted to int; for those, the (exception raising) conversion is not tried
+_NON_INT_TYPE_CODES = frozenset((gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION, gdb.TYPE_CODE_ARRAY,
+                                 gdb.TYPE_CODE_VOID, gdb.TYPE_CODE_FUNC))
+
+# global variable with all no-stop breakpoints; maps the (stripped) breakpoint location to the list of no-stop
+# breakpoints at this location such that deleting a breakpoint by location does not require a scan of all breakpoints
+no_stop_bps = {}
 
-# global variable with all no-stop breakpoints
-no_stop_bps = []
+
+def _no_stop_bps_add(bp):
+    no_stop_bps.setdefault(bp.get_func().strip(), []).append(bp)
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -59,13 +70,11 @@ class DottCmdInterceptPointCmds(gdb.Command):
 
         try:
             # de-serialize breakpoint location and commands
-            my_args = arg.replace('\\"', '"')
-            my_args = json.loads(my_args)
+            my_args = BpCmdList.decode(arg)
 
             # create breakpoint and add it to the list
             bp = InterceptPointCmds(my_args[0], my_args[1:])
-            global no_stop_bps
-            no_stop_bps.append(bp)
+            _no_stop_bps_add(bp)
 
         except Exception as ex:
             print(str(ex))
@@ -85,11 +94,13 @@ class DottCmdInterceptPoint(gdb.Command):
                 self._func = func
                 self._sock = sock
                 self._sock.setblocking(True)
+                self._rfile = sock.makefile('rb')
 
             def get_func(self):
                 return self._func
 
             def close(self):
+                self._rfile.close()
                 self._sock.close()
                 self._sock = None
 
@@ -100,12 +111,11 @@ class DottCmdInterceptPoint(gdb.Command):
                     return stop_inferior
 
                 try:
-                    msg = BpMsg(BpMsg.MSG_TYPE_HIT) # bp hit message
-                    msg.send_to_socket(self._sock)
+                    self._sock.sendall(_HIT_BYTES)  # bp hit message
 
                     while True:
                         # blocks until new message is available
-                        msg = BpMsg.read_from_socket(self._sock)
+                        msg = BpMsg.read_from_stream(self._rfile)
 
                         # 'finish' message - resume target execution
                         if msg.get_type() == BpMsg.MSG_TYPE_FINISH_CONT:
@@ -117,8 +127,7 @@ class DottCmdInterceptPoint(gdb.Command):
                             try:
                                 cmd = msg.get_payload().decode('ascii')
                                 gdb.execute(cmd)
-                                msg = BpMsg(BpMsg.MSG_TYPE_RESP)  # response message
-                                msg.send_to_socket(self._sock)
+                                self._sock.sendall(_RESP_BYTES)  # response message
                             except Exception as ex:
                                 msg = BpMsg(BpMsg.MSG_TYPE_EXCEPT, str(ex))  # exception message
                                 msg.send_to_socket(self._sock)
@@ -129,10 +138,13 @@ class DottCmdInterceptPoint(gdb.Command):
                                 cmd = msg.get_payload().decode('ascii')
                                 res = gdb.parse_and_eval(cmd)
                                 pload = None
-                                try:
-                                    pload = str(int(res))
-                                except:
+                                if res.type.strip_typedefs().code in _NON_INT_TYPE_CODES:
                                     pload = str(res)
+                                else:
+                                    try:
+                                        pload = str(int(res))
+                                    except:
+                                        pload = str(res)
                                 msg = BpMsg(BpMsg.MSG_TYPE_RESP, pload)  # response message
                                 msg.send_to_socket(self._sock)
                             except Exception as ex:
@@ -151,15 +163,18 @@ class DottCmdInterceptPoint(gdb.Command):
                 return stop_inferior
 
         try:
+            # arguments: <port of server socket in MI process> <breakpoint location>
+            port, func = arg.split(None, 1)
+
             # connect to server socket (in MI process)
             import socket
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect(('127.0.0.1', BpSharedConf.GDB_CMD_SERVER_PORT))
+            sock.connect(('127.0.0.1', int(port)))
+            BpSharedConf.setup_socket(sock)
 
             # create breakpoint and add it to the list
-            bp = InterceptPoint(arg, sock)
-            global no_stop_bps
-            no_stop_bps.append(bp)
+            bp = InterceptPoint(func, sock)
+            _no_stop_bps_add(bp)
 
         except Exception as ex:
             print(str(ex))
@@ -171,23 +186,25 @@ class DottCmdInterceptPointDelete(gdb.Command):
         super(DottCmdInterceptPointDelete, self).__init__("dott-bp-nostop-delete", gdb.COMMAND_USER)
 
     def invoke(self, arg, from_tty):
-        global no_stop_bps
-
         if len(arg) == 0:
-            # note: iterating over a copy of the list
-            for bp in no_stop_bps[:]:
-                bp.delete()  # delete function of gdb.Breakpoint
-                bp.close()  # close down socket connection to MI process
-                no_stop_bps.remove(bp)
-
-        else:
-            # note: iterating over a copy of the list
-            for bp in no_stop_bps[:]:
-                if arg.strip() == bp.get_func().strip():
+            # note: iterating over copies of the dict and the lists
+            for func, bps in list(no_stop_bps.items()):
+                for bp in bps[:]:
                     bp.delete()  # delete function of gdb.Breakpoint
                     bp.close()  # close down socket connection to MI process
-                    no_stop_bps.remove(bp)
-                    break
+                    bps.remove(bp)
+                del no_stop_bps[func]
+
+        else:
+            func = arg.strip()
+            bps = no_stop_bps.get(func)
+            if bps:
+                bp = bps[0]
+                bp.delete()  # delete function of gdb.Breakpoint
+                bp.close()  # close down socket connection to MI process
+                bps.pop(0)
+                if len(bps) == 0:
+                    del no_stop_bps[func]
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -18,16 +18,23 @@
 # Authors:
 # - Thomas Winkler, ams AG, thomas.winkler@ams.com
 
+import platform
 import queue
+import re
+import select
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
-from typing import Dict
+from typing import Dict, List, Optional
 
 from pygdbmi.gdbcontroller import GdbController
 
 from dottmi.dottexceptions import DottException
 from dottmi.utils import BlockingDict, log
 
+# queue.SimpleQueue is only available from Python 3.7 on
+_SimpleQueue = getattr(queue, 'SimpleQueue', queue.Queue)
+
 
 # ----------------------------------------------------------------------------------------------------------------------
 class GdbMi(object):
@@ -113,6 +120,25 @@ class GdbMi(object):
                 else:
                     raise Exception("GDB Error: %s" % msg['payload']['msg'])
 
+    def _check_context(self) -> None:
+        context = self._mi_context.get_context()
+        if context != GdbMiContext.NORMAL:
+            if context == GdbMiContext.BP_INTERCEPT:
+                # Provide a more specific error message when in InterceptPoint context.
+                raise DottException('Cannot use normal DOTT commands to interact with the target while executing in '
+                                    'InterceptPoint context. Instead, use eval/exec methods provided by the'
+                                    'InterceptPoint implementation!')
+            else:
+                raise DottException('Cannot use normal DOTT commands to interact with the target while not executing '
+                                    'NORMAL context!')
+
+    def _write(self, mi_cmds: str) -> None:
+        try:
+            self._mi_controller.write(mi_cmds, read_response=False)
+        except IOError:
+            log.warn('Got I/O error form gdb client! GDB session might have been closed prematurely due to previous '
+                     'errors in this session. Check for any previous warning or error messages.')
+
     def write_non_blocking(self, cmd: str) -> int:
         """
         Sends the provided command to GDB without blocking.
@@ -123,26 +149,37 @@ class GdbMi(object):
             The token which identifies the command sent to GDB. It is used to related GDB's response to the commands
             sent to it.
         """
-        if self._mi_context.get_context() != GdbMiContext.NORMAL:
-            if self._mi_context.get_context() == GdbMiContext.BP_INTERCEPT:
-                # Provide a more specific error message when in InterceptPoint context.
-                raise DottException('Cannot use normal DOTT commands to interact with the target while executing in '
-                                    'InterceptPoint context. Instead, use eval/exec methods provided by the'
-                                    'InterceptPoint implementation!')
-            else:
-                raise DottException('Cannot use normal DOTT commands to interact with the target while not executing '
-                                    'NORMAL context!')
+        self._check_context()
 
         token = self._get_next_mi_token()
         if self._trace_commands:
             log.debug(f'{token}         gdb write: {cmd}')
-        try:
-            self._mi_controller.write("%d%s" % (token, cmd), read_response=False)
-        except IOError:
-            log.warn('Got I/O error form gdb client! GDB session might have been closed prematurely due to previous '
-                     'errors in this session. Check for any previous warning or error messages.')
+        self._write("%d%s" % (token, cmd))
         return token
 
+    def write_non_blocking_many(self, cmds: List[str]) -> List[int]:
+        """
+        Sends the provided commands to GDB without blocking. All commands are handed to GDB with a single write.
+        Args:
+            cmds: The commands to be sent to GDB.
+
+        Returns:
+            The tokens which identify the commands sent to GDB (same order as cmds).
+        """
+        self._check_context()
+
+        tokens = []
+        lines = []
+        for cmd in cmds:
+            token = self._get_next_mi_token()
+            if self._trace_commands:
+                log.debug(f'{token}         gdb write: {cmd}')
+            tokens.append(token)
+            lines.append("%d%s" % (token, cmd))
+        if len(lines) > 0:
+            self._write('\n'.join(lines))
+        return tokens
+
     def write_blocking(self, cmd: str, timeout: float = None) -> Dict:
         """
         Sends the provided command to GDB and blocks until gdb returns with the result of the command.
@@ -157,6 +194,39 @@ class GdbMi(object):
         token = self.write_non_blocking(cmd)
         return self._mi_wait_token_result(token, timeout)
 
+    def write_blocking_many(self, cmds: List[str], timeout: float = None, return_exceptions: bool = False) -> List:
+        """
+        Sends all provided commands to GDB and then blocks until GDB has returned the results for all of them. Compared
+        to calling write_blocking for each command, the round trips to GDB overlap.
+        Args:
+            cmds: The commands to be sent to GDB.
+            timeout: The amount of time to block at maximum while waiting for each of the responses. If the timeout is
+            reached, a TimeoutError exception is raised.
+            return_exceptions: If True, the exception of a failed command is put into the result list (instead of
+            raising the exception of the first failed command once all results were collected).
+
+        Returns:
+            The results of the commands sent to GDB as a list of dictionaries (same order as cmds).
+        """
+        tokens = self.write_non_blocking_many(cmds)
+
+        # collect all results (even if a command failed) such that no result is left behind in the response dict
+        results = []
+        error = None
+        for token in tokens:
+            try:
+                results.append(self._mi_wait_token_result(token, timeout))
+            except TimeoutError:
+                raise
+            except Exception as ex:
+                if return_exceptions:
+                    results.append(ex)
+                elif error is None:
+                    error = ex
+        if error is not None:
+            raise error
+        return results
+
     def shutdown(self) -> None:
         """
         Stops the gdb response handler.
@@ -196,16 +266,23 @@ class GdbMiContext(object):
                 self._context_holder = None
 
     def get_context(self) -> int:
-        with self._context_lock:
-            return self._context
+        # note: reading a single attribute is atomic; the lock is only required for the check-and-set operations above
+        return self._context
 
 
 # ----------------------------------------------------------------------------------------------------------------------
 class GdbMiResponseHandler(threading.Thread):
+    # responses of DOTT's GDB commands (cp. gdb_cmds.py) start with 'DOTT_RESP, <response id>,'
+    _DOTT_RESP_RE = re.compile(r'DOTT_RESP,\s*(\d+),')
+
     def __init__(self, mi_controller: GdbController, dicts: Dict) -> None:
         super().__init__(name='GdbResponseHandler')
         self._mi_controller = mi_controller
         self._response_dicts = dicts
+        # response dicts used by the message handlers (bound once instead of being looked up per message)
+        self._result_dict: BlockingDict = dicts['result']
+        self._console_dict: BlockingDict = dicts['console']
+        self._notify_dict: BlockingDict = dicts['notify']
         self._running = False
         self._notify_subscribers = {}
 
@@ -217,79 +294,100 @@ class GdbMiResponseHandler(threading.Thread):
     def stop(self) -> None:
         self._running = False
 
+    def _get_wait_fds(self) -> Optional[List[int]]:
+        # Except for Windows (where select does not support pipes) the handler blocks on GDB's output pipes until data
+        # is available and then drains them without further waiting. Otherwise, pygdbmi's polling is used.
+        if platform.system() == 'Windows':
+            return None
+        gdb_process = self._mi_controller.gdb_process
+        return [gdb_process.stdout.fileno(), gdb_process.stderr.fileno()]
+
+    def _handle_result(self, msg: Dict) -> None:
+        msg_token = -1
+        if 'token' in msg:
+            msg_token = msg['token']
+            # log.debug('[MSG] %s' % msg)
+        else:
+            log.warn('result w/o token: ')
+            pprint(msg)
+        self._result_dict.put(msg_token, msg)
+
+    def _handle_console(self, msg: Dict) -> None:
+        if 'payload' in msg:
+            m = self._DOTT_RESP_RE.match(msg['payload'])
+            if m is not None:
+                self._console_dict.put(int(m.group(1)), msg)
+        else:
+            self._console_dict.put(0, msg)
+        # log.debug('[CON] %s' % bytes(msg['payload'], 'ascii').decode('unicode_escape').rstrip())
+
+    def _handle_notify(self, msg: Dict) -> None:
+        notify_msg = msg['message']  # e.g., 'stopped', 'running', ...
+        # log.info("[NOTIFY] %s", msg)
+
+        notify_reason = None
+        if 'reason' in msg['payload']:
+            notify_reason = msg['payload']['reason']
+            if type(notify_reason) is list and 'breakpoint-hit' in notify_reason:
+                # Special case for OpenOCD which returns a list ['signal-received', ''breakpoint-hit]
+                # instead of just 'breakpoint-hit'.
+                notify_reason = 'breakpoint-hit'
+                msg['payload']['reason'] = notify_reason
+            if notify_reason == 'breakpoint-hit' and 'bkptno' in msg['payload']:
+                # convert breakpoint number once here such that subscribers can use it as is
+                msg['payload']['bkptno'] = int(msg['payload']['bkptno'])
+
+        subscribers = self._notify_subscribers
+        already_notified = []
+        for subscriber in subscribers.get((notify_msg, notify_reason), ()):
+            subscriber.notify(msg)
+            already_notified.append(subscriber)
+        if notify_reason is not None:
+            for subscriber in subscribers.get((notify_msg, None), ()):
+                if subscriber not in already_notified:
+                    subscriber.notify(msg)
+
+        # if there are no subscribers for this notification it is stored in a dict for later analysis
+        if len(already_notified) == 0:
+            self._notify_dict.put((notify_msg, notify_reason), msg)
+
+    def _handle_ignore(self, msg: Dict) -> None:
+        # 'output', 'target' and 'log' messages are not used by DOTT
+        pass
+
+    def _handle_unknown(self, msg: Dict) -> None:
+        log.warn(f'Unknown message type: {msg["type"]}')
+        log.warn(f'Full message: {msg}')
+
     def run(self) -> None:
         self._running = True
+        wait_fds = self._get_wait_fds()
+        get_gdb_response = self._mi_controller.get_gdb_response
+
+        # message handlers by message type (pygdbmi already provides the type in lower case)
+        dispatch = {'result': self._handle_result,
+                    'console': self._handle_console,
+                    'notify': self._handle_notify,
+                    'output': self._handle_ignore,
+                    'target': self._handle_ignore,
+                    'log': self._handle_ignore}
+        dispatch_get = dispatch.get
+        handle_unknown = self._handle_unknown
 
         while self._running:
             try:
-                messages = self._mi_controller.get_gdb_response(timeout_sec=0.005, raise_error_on_timeout=False)
+                if wait_fds is not None:
+                    # note: the select timeout only bounds the time it takes to notice a call to stop()
+                    ready, _, _ = select.select(wait_fds, [], [], 0.1)
+                    if not ready:
+                        continue
+                    messages = get_gdb_response(timeout_sec=0, raise_error_on_timeout=False)
+                else:
+                    messages = get_gdb_response(timeout_sec=0.005, raise_error_on_timeout=False)
 
                 for msg in messages:
-                    msg_type = str(msg['type']).lower()
                     # log.debug('[MSG] %s' % msg)
-
-                    if msg_type == 'result':
-                        msg_token = -1
-                        if 'token' in msg:
-                            msg_token = msg['token']
-                            # log.debug('[MSG] %s' % msg)
-                        else:
-                            log.warn('result w/o token: ')
-                            pprint(msg)
-                        self._response_dicts['result'].put(msg_token, msg)
-
-                    elif msg_type == 'console':
-                        if 'payload' in msg:
-                            payload = msg['payload']
-                            if 'DOTT_RESP' in payload:
-                                resp_id = (int(payload.split(',')[1]))
-                                self._response_dicts['console'].put(resp_id, msg)
-                        else:
-                            self._response_dicts['console'].put(0, msg)
-                        # log.debug('[CON] %s' % bytes(msg['payload'], 'ascii').decode('unicode_escape').rstrip())
-
-                    elif msg_type == 'output':
-                        pass
-                        # log.debug('[OUT] %s' % bytes(msg['payload'], 'ascii').decode('unicode_escape').rstrip())
-
-                    elif msg_type == 'target':
-                        pass
-                        # log.debug("[TARGET] %s", msg['payload'])
-
-                    elif msg_type == 'notify':
-                        notify_msg = msg['message']  # e.g., 'stopped', 'running', ...
-                        # log.info("[NOTIFY] %s", msg)
-
-                        notify_reason = None
-                        if 'reason' in msg['payload']:
-                            notify_reason = msg['payload']['reason']
-                            if type(notify_reason) is list and 'breakpoint-hit' in notify_reason:
-                                # Special case for OpenOCD which returns a list ['signal-received', ''breakpoint-hit]
-                                # instead of just 'breakpoint-hit'.
-                                notify_reason = 'breakpoint-hit'
-                                msg['payload']['reason'] = notify_reason
-
-                        already_notified = []
-                        if (notify_msg, notify_reason) in self._notify_subscribers:
-                            for subscriber in self._notify_subscribers[(notify_msg, notify_reason)]:
-                                subscriber.notify(msg)
-                                already_notified.append(subscriber)
-                        if (notify_msg, None) in self._notify_subscribers:
-                            for subscriber in self._notify_subscribers[(notify_msg, None)]:
-                                if subscriber not in already_notified:
-                                    subscriber.notify(msg)
-
-                        # if there are no subscribers for this notification it is stored in a dict for later analysis
-                        if len(already_notified) == 0:
-                            self._response_dicts['notify'].put((notify_msg, notify_reason), msg)
-
-                    elif msg_type == 'log':
-                        pass
-                        # log.debug("[LOG] %s", msg['payload'])
-
-                    else:
-                        log.warn(f'Unknown message type: {msg_type}')
-                        log.warn(f'Full message: {msg}')
+                    dispatch_get(msg['type'], handle_unknown)(msg)
 
             except IOError as ex:
                 log.exception(ex)
@@ -303,14 +401,31 @@ class GdbMiResponseHandler(threading.Thread):
 # ----------------------------------------------------------------------------------------------------------------------
 class NotifySubscriber(object):
     def __init__(self):
-        self._notifications: queue.Queue = queue.Queue()
+        # note: task_done/join are not needed; hence, the more lightweight SimpleQueue is used
+        self._notifications: queue.Queue = _SimpleQueue()
+
+        # Note: Callback handlers are executed in a separate thread to ensure that main gdbmi thread is not blocked.
+        # This is important as callback handlers can issue their own GDB requests which might lead to deadlocks if
+        # callback handlers are called in gdbmi context. A single worker thread per subscriber is used (callbacks are
+        # executed in order of the notifications). Subscribers which do not implement a callback don't get a worker.
+        self._notify_executor: Optional[ThreadPoolExecutor] = None
+        if type(self)._notify_callback is not NotifySubscriber._notify_callback:
+            self._notify_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='NotifyCallback')
 
     def notify(self, msg: Dict) -> None:
         self._notifications.put(msg)
-        # Note: Callback handlers are executed in own thread to ensure that main gdbmi thread is not blocked. This is
-        # important as callback handlers can issue their own GDB requests which might lead to deadlocks if callback
-        # handlers are called in gdbmi context.
-        threading.Thread(target=self._notify_callback).start()
+        if self._notify_executor is not None:
+            try:
+                self._notify_executor.submit(self._notify_callback)
+            except RuntimeError:
+                pass  # notification received after notify_close (i.e., while shutting down)
+
+    def notify_close(self) -> None:
+        """
+        Stops the worker thread executing the notification callbacks. Pending callbacks are still executed.
+        """
+        if self._notify_executor is not None:
+            self._notify_executor.shutdown(wait=False)
 
     def _notify_callback(self):
         pass
@@ -18,20 +18,34 @@
 # Authors:
 # - Thomas Winkler, ams AG, thomas.winkler@ams.com
 
+import base64
 import os
+import socket
 import struct
 
 
 class BpSharedConf():
-    # server-side port of TCP connection between MI and GDB process
-    GDB_CMD_SERVER_PORT = 20080
+    # seconds the MI process waits for the GDB process to connect when creating an intercept point
+    ACCEPT_TIMEOUT_SECS = 5
+
+    @staticmethod
+    def setup_socket(sock):
+        # Messages exchanged between MI and GDB process are small and latency-critical. Hence, Nagle's algorithm is
+        # disabled.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class BpMsg(object):
+    __slots__ = ('_magic', '_msg_type', '_payload', '_payload_len')
 
-class BpMsg():
     # header magic number
-    MSG_HDR_MAGIC = b'\xd0\x11'
+    MSG_HDR_MAGIC = b'\xd0\x12'
 
-    # header length (2 bytes for magic, 1 byte for type and 2 bytes for payload length)
-    MSG_HDR_LEN = 5
+    # header layout (2 bytes for magic, 1 byte for type and 4 bytes for payload length); the struct is compiled once
+    # and reused for all messages
+    # note: the magic was changed along with the width of the payload length field (formerly 2 bytes)
+    MSG_HDR = struct.Struct('=2scI')
+    MSG_HDR_LEN = MSG_HDR.size
 
     # message types
     MSG_TYPE_HIT  = b'\x01'
@@ -69,36 +83,61 @@ class BpMsg():
         return self._payload
 
     @classmethod
-    def read_from_socket(cls, sock, timeout=None):
-
-        remaining = cls.MSG_HDR_LEN
-        while remaining > 0:
-            header = sock.recv(remaining)
-            remaining -= len(header)
+    def read_from_stream(cls, stream):
+        # Reads a message from a buffered file object (as returned by socket.makefile('rb')). Header and payload are
+        # then typically served from a single recv call instead of one call per part.
+        header = stream.read(cls.MSG_HDR_LEN)
+        if len(header) < cls.MSG_HDR_LEN:
+            raise EOFError('Connection closed while reading breakpoint message header.')
 
-        magic = header[0:2]
-        msg_type = header[2:3]
-        payload_len = struct.unpack('H', header[3:5])[0]
+        magic, msg_type, payload_len = cls.MSG_HDR.unpack(header)
 
         if magic != BpMsg.MSG_HDR_MAGIC:
             raise ValueError('Wrong header magic for breakpoint message.')
 
         payload = None
         if payload_len > 0:
-            payload = b''
-            remaining = payload_len
-            while remaining > 0:
-                payload += sock.recv(remaining)
-                remaining = payload_len - len(payload)
+            payload = stream.read(payload_len)
+            if len(payload) < payload_len:
+                raise EOFError('Connection closed while reading breakpoint message payload.')
 
         instance = cls(msg_type, payload)
         return instance
 
-    def send_to_socket(self, sock):
-        payload_len_bytes = struct.pack('H', self._payload_len)
-        header = BpMsg.MSG_HDR_MAGIC + self._msg_type + payload_len_bytes
-        sock.sendall(header)
+    def serialize(self):
+        header = BpMsg.MSG_HDR.pack(BpMsg.MSG_HDR_MAGIC, self._msg_type, self._payload_len)
         if self._payload_len > 0:
-            sock.sendall(self._payload)
-
+            return header + self._payload
+        return header
 
+    def send_to_socket(self, sock):
+        # header and payload are sent with a single call such that they do not end up in separate segments
+        sock.sendall(self.serialize())
+
+
+class BpCmdList():
+    # Serialization of the breakpoint location and command list handed to the dott-bp-nostop-cmd GDB command. Each
+    # string is encoded as 2-byte length followed by its UTF-8 bytes. The resulting frame is base64-encoded such that
+    # it can be passed as plain argument on the GDB command line without any escaping.
+    ITEM_LEN = struct.Struct('!H')
+
+    @staticmethod
+    def encode(items):
+        parts = []
+        for item in items:
+            item = item.encode('utf-8')
+            parts.append(BpCmdList.ITEM_LEN.pack(len(item)))
+            parts.append(item)
+        return base64.b64encode(b''.join(parts)).decode('ascii')
+
+    @staticmethod
+    def decode(arg):
+        frame = base64.b64decode(arg.strip())
+        items = []
+        pos = 0
+        while pos < len(frame):
+            item_len = BpCmdList.ITEM_LEN.unpack_from(frame, pos)[0]
+            pos += BpCmdList.ITEM_LEN.size
+            items.append(frame[pos:pos + item_len].decode('utf-8'))
+            pos += item_len
+        return items
@@ -31,10 +31,14 @@ class LogFilter(logging.Filter):
         return True
 
 
+# note: a single filter instance is used such that it is installed only once (addFilter ignores known filters)
+_log_filter = LogFilter()
+
+
 class GdbControllerDott(GdbController):
     def __init__(self, command,
                  time_to_check_for_additional_output_sec=DEFAULT_TIME_TO_CHECK_FOR_ADDITIONAL_OUTPUT_SEC):
 
         # set logging filter for pygdbmi
-        logging.getLogger().addFilter(LogFilter())
+        logging.getLogger().addFilter(_log_filter)
         super().__init__(command, time_to_check_for_additional_output_sec)
@@ -18,16 +18,45 @@
 # Authors:
 # - Thomas Winkler, ams AG, thomas.winkler@ams.com
 
+import atexit
 import logging
 import os
+import struct
 import tempfile
-from typing import List
+import threading
+from typing import Dict, List, Optional, Tuple, Union
 
 import pylink
 from pylink import JLink
 
 from dottmi.dott import DottConf
 from dottmi.dottexceptions import DottException
+from dottmi.utils import log
+
+
+# content last written to JLinkDevices.ref by this process (see _JlinkDott)
+_jlink_devices_ref: Optional[str] = None
+
+
+def _write_jlink_devices_ref(content: str) -> None:
+    global _jlink_devices_ref
+    if _jlink_devices_ref == content:
+        return
+
+    out_file_name = os.path.join(tempfile.gettempdir(), 'JLinkDevices.ref')
+    try:
+        with open(out_file_name, 'r') as in_file:
+            up_to_date = in_file.read() == content
+    except OSError:
+        up_to_date = False
+
+    if not up_to_date:
+        # write to a temporary file and then replace the reference file such that readers never see partial content
+        tmp_file_name = f'{out_file_name}.{os.getpid()}.tmp'
+        with open(tmp_file_name, 'w') as out_file:
+            out_file.write(content)
+        os.replace(tmp_file_name, out_file_name)
+    _jlink_devices_ref = content
 
 
 class _JlinkDott(JLink):
@@ -46,9 +75,7 @@ class _JlinkDott(JLink):
         super().__init__(lib, log, detailed_log, error, warn, unsecure_hook)
 
         # create a reference to the folder which contains the JLinkDevices.xml (supporting relative flash loader paths)
-        out_file_name = os.path.join(tempfile.gettempdir(), 'JLinkDevices.ref')
-        with open(out_file_name, 'w') as out_file:
-            out_file.write(os.path.dirname(self._library._path) + os.path.sep)
+        _write_jlink_devices_ref(os.path.dirname(self._library._path) + os.path.sep)
 
     def _find_library(self):
         """
@@ -58,52 +85,180 @@ class _JlinkDott(JLink):
         yield os.path.join(DottConf.get('jlink_path'), DottConf.get('jlink_lib_name'))
 
 
+# -------------------------------------------------------------------------------------------------
+class JlinkConnectionPool(object):
+    """
+    Keeps opened and connected J-Link instances around after they have been released such that they can be re-used
+    instead of going through probe enumeration and target connection again. Instances are created lazily on acquire.
+    At most one idle instance is kept per probe/device; further instances are closed on release. The pool is used by
+    TargetDirect instances created with pooled=True.
+    """
+
+    def __init__(self, max_usage: int = 0):
+        """
+        Args:
+            max_usage: Number of times an instance is handed out before it is closed on release (and hence re-opened
+                       on the next acquire). 0 means unlimited re-use.
+        """
+        self._max_usage: int = max_usage
+        self._lock: threading.Lock = threading.Lock()
+        self._idle: Dict[Tuple, Tuple[JLink, int]] = {}
+        self._in_use: Dict[int, Tuple[Tuple, int]] = {}
+
+    def acquire(self, serial: Optional[int], addr_port: Optional[str], device: str) -> JLink:
+        key = (serial, addr_port, device)
+        with self._lock:
+            jlink, usage = self._idle.pop(key, (None, 0))
+
+        if jlink is not None and not (jlink.opened() and jlink.target_connected()):
+            JlinkConnectionPool._close(jlink)
+            jlink = None
+
+        if jlink is None:
+            jlink = _JlinkDott()
+            jlink.open(serial, addr_port)
+            jlink.connect(device, verbose=False)
+            usage = 0
+
+        with self._lock:
+            self._in_use[id(jlink)] = (key, usage + 1)
+        return jlink
+
+    def release(self, jlink: JLink) -> None:
+        with self._lock:
+            entry = self._in_use.pop(id(jlink), None)
+            if entry is None:
+                return  # not handed out by the pool or already released
+            key, usage = entry
+            if (self._max_usage == 0 or usage < self._max_usage) and key not in self._idle:
+                self._idle[key] = (jlink, usage)
+                return
+        JlinkConnectionPool._close(jlink)
+
+    def close_all(self) -> None:
+        """
+        Closes all idle instances.
+        """
+        with self._lock:
+            idle = list(self._idle.values())
+            self._idle.clear()
+        for jlink, _ in idle:
+            JlinkConnectionPool._close(jlink)
+
+    @staticmethod
+    def _close(jlink: JLink) -> None:
+        try:
+            jlink.close()
+        except Exception as ex:
+            log.debug(f'Closing J-Link failed: {ex}')
+
+
+_jlink_pool = JlinkConnectionPool()
+atexit.register(_jlink_pool.close_all)
+
+
 # -------------------------------------------------------------------------------------------------
 class TargetDirect(object):
-    def __init__(self, device_name: str):
+    def __init__(self, device_name: str, pooled: bool = False):
+        """
+        Args:
+            device_name: Name of the target device as known by J-Link.
+            pooled: If True, the J-Link connection is taken from (and returned to upon disconnect) a process-wide
+                    connection pool instead of being opened (and closed upon disconnect) by this instance.
+        """
         jlink_ip_addr = DottConf.get('jlink_server_addr')
         jlink_port = DottConf.get('jlink_server_port')
         jlink_serial = DottConf.get('jlink_serial')
 
         jlink_addr_port = f'{jlink_ip_addr}:{jlink_port}' if jlink_ip_addr is not None else None
 
-        self._jlink = _JlinkDott()
-        self._jlink.open(jlink_serial, jlink_addr_port)
-        self._jlink.connect(device_name, verbose=False)
+        self._pooled: bool = pooled
+        if pooled:
+            self._jlink = _jlink_pool.acquire(jlink_serial, jlink_addr_port, device_name)
+        else:
+            self._jlink = _JlinkDott()
+            self._jlink.open(jlink_serial, jlink_addr_port)
+            self._jlink.connect(device_name, verbose=False)
 
-    def mem_read_32(self, addr: int, cnt: int = 1) -> int:
+    def mem_read_32(self, addr: int, cnt: int = 1, as_bytes: bool = False) -> Union[int, List[int], bytes]:
         """
         This function performs a 32bit memory read from target memory while the target is running.
 
         Args:
             addr: Target memory address to read from.
             cnt: Number of 32bit words to be read from the target.
+            as_bytes: If True, the memory content is returned as bytes (in target byte order) instead of integers.
+                      This avoids creating one integer object per word for large reads.
 
         Returns: 32bit integer containing content read form target if cnt is 1, otherwise a list of 32bit integers
-                 is returned.
+                 is returned. If as_bytes is True, bytes with a length of cnt * 4 are returned.
         """
         self._jlink.halted()  # no-op required to ensure that pylink's state is in sync with the hardware
+        if as_bytes:
+            return bytes(self._jlink.memory_read8(addr, cnt * 4))
         ret = self._jlink.memory_read(addr, cnt, nbits=32)
         return ret[0] if len(ret) > 0 else ret
 
-    def mem_write_32(self, addr: int, data: List) -> int:
+    def mem_read_many(self, reads: List[Tuple[int, int]], max_gap: int = 0) -> List[List[int]]:
+        """
+        This function performs multiple 32bit memory reads from target memory while the target is running. Reads with
+        adjacent or overlapping address ranges are merged and performed as a single read.
+
+        Args:
+            reads: List of (addr, cnt) tuples with the address to read from and the number of 32bit words to be read.
+            max_gap: Reads which are at most max_gap bytes apart are also merged. Note that this means that the memory
+                     in between is read as well. Hence, only use this for memory where reads have no side effects.
+
+        Returns: List with one list of 32bit integers per read (same order as reads).
+        """
+        # determine the address ranges to be read; each range is [start, end, indices of the reads it covers]
+        ranges = []
+        for idx in sorted(range(len(reads)), key=lambda i: reads[i][0]):
+            addr, cnt = reads[idx]
+            if ranges and addr <= ranges[-1][1] + max_gap and (addr - ranges[-1][0]) % 4 == 0:
+                ranges[-1][1] = max(ranges[-1][1], addr + cnt * 4)
+                ranges[-1][2].append(idx)
+            else:
+                ranges.append([addr, addr + cnt * 4, [idx]])
+
+        results: List[List[int]] = [[] for _ in reads]
+        self._jlink.halted()  # no-op required to ensure that pylink's state is in sync with the hardware
+        for start, end, indices in ranges:
+            words = self._jlink.memory_read(start, (end - start) // 4, nbits=32)
+            for idx in indices:
+                offset = (reads[idx][0] - start) // 4
+                results[idx] = words[offset:offset + reads[idx][1]]
+        return results
+
+    def mem_write_32(self, addr: int, data: Union[List, bytes, bytearray]) -> int:
         """
         This function performs a 32bit memory write to target memory while the target is running.
         Args:
             addr: Target memory address to write to.
-            data: List of 32bit words to be written to the target starting at the provided address.
+            data: List of 32bit words to be written to the target starting at the provided address. Alternatively,
+                  bytes (or bytearray) with a length which is a multiple of 4 and which are interpreted as 32bit
+                  words in target byte order (device_endianess), i.e., as returned by mem_read_32 with as_bytes=True.
 
         Returns: The number of 32bit words written.
 
         """
+        if isinstance(data, (bytes, bytearray)):
+            if len(data) % 4 != 0:
+                raise DottException('Length of data for 32bit memory write must be a multiple of 4!')
+            byte_order = '<' if DottConf.get('device_endianess') == 'little' else '>'
+            data = list(struct.unpack(f'{byte_order}{len(data) // 4}I', data))
         ret = self._jlink.memory_write(addr, data, nbits=32)
         return ret  # number of units written
 
     def disconnect(self) -> None:
         """
-        This function closes te live access connection to the target.
+        This function closes te live access connection to the target. For pooled instances, the underlying J-Link
+        connection is returned to the connection pool such that it can be re-used by the next pooled instance.
         """
-        self._jlink.close()
+        if self._pooled:
+            _jlink_pool.release(self._jlink)
+        else:
+            self._jlink.close()
 
     @property
     def jlink_raw(self) -> JLink:
@@ -19,6 +19,9 @@
 # - Thomas Winkler, ams AG, thomas.winkler@ams.com
 
 import logging
+from typing import Dict, FrozenSet, Optional
+
+from dottmi.dottexceptions import DottException
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -27,10 +30,49 @@ class BinarySymbols(object):
 
     def __init__(self, target):
         self._target = target
+        self._all_symbols: Optional[FrozenSet[str]] = None
+        self._queried: Dict[str, bool] = {}
+
+    def _load_all(self) -> FrozenSet[str]:
+        # Fetch the names of all functions and variables in one go. GDB versions before 10 do not support the
+        # -symbol-info-* commands. In this case the set remains empty and exists() falls back to per-symbol queries.
+        names = set()
+        for cmd in ('-symbol-info-functions --include-nondebug', '-symbol-info-variables --include-nondebug'):
+            try:
+                res = self._target.exec(cmd)
+            except Exception:
+                continue
+            syms = res['payload'].get('symbols', {})
+            for src_file in syms.get('debug', []):
+                names.update(sym['name'] for sym in src_file.get('symbols', []))
+            names.update(sym['name'] for sym in syms.get('nondebug', []))
+        return frozenset(names)
+
+    def invalidate(self) -> None:
+        """
+        Discards the cached symbol names. Needs to be called when the symbol file loaded into GDB changes.
+        """
+        self._all_symbols = None
+        self._queried.clear()
 
     def exists(self, sym_name: str) -> bool:
+        if self._all_symbols is None:
+            self._all_symbols = self._load_all()
+        if sym_name in self._all_symbols:
+            return True
+
+        found = self._queried.get(sym_name)
+        if found is not None:
+            return found
+
+        # not a plain symbol name known from the bulk query (e.g., 'file.c:func') - ask GDB directly
         try:
             self._target.cli_exec(f'info address {sym_name}')
-            return True
-        except Exception as ex:
-            return False
+            found = True
+        except (DottException, TimeoutError):
+            # not a 'no symbol' reply from GDB but a problem with the connection or the current context
+            raise
+        except Exception:
+            found = False
+        self._queried[sym_name] = found
+        return found
@@ -20,6 +20,7 @@
 
 import logging
 import os
+import re
 import threading
 import time
 import datetime
@@ -39,6 +40,36 @@ from dottmi.utils import cast_str, log
 logging.basicConfig(level=logging.DEBUG)
 
 
+# script with custom GDB commands; note: GDB expects paths to be POSIX-formatted.
+_GDB_SCRIPT_FILE = str(PurePosixPath(Path(__file__).absolute().parent.joinpath('gdb_cmds.py')))
+
+# expressions which are passed to GDB MI without quoting (plain symbol names and convenience variables/registers)
+_PLAIN_EXPR_RE = re.compile(r'[A-Za-z_$][\w$]*')
+
+
+def _eval_cmd(expr: str) -> str:
+    if _PLAIN_EXPR_RE.fullmatch(expr):
+        return f'-data-evaluate-expression {expr}'
+    return f'-data-evaluate-expression "{expr}"'
+
+
+# xPSR fields of Arm Cortex-M MCUs as (label, shift, mask, format spec, suffix) used by Target.reg_xpsr_to_str
+_XPSR_FIELDS = (
+    ('negative (N):. .....', 31, 0b1, '', ''),
+    ('zero (Z): ..........', 30, 0b1, '', ''),
+    ('carry (C): .........', 29, 0b1, '', ''),
+    ('overflow (V): ......', 28, 0b1, '', ''),
+    ('cumulative sat. (Q):', 27, 0b1, '', ''),
+    ('if/then/else (IT): .', 25, 0b11, '02b', '     (IT[1:0)'),
+    ('thumb state (T): ...', 24, 0b1, '', ''),
+    ('gt or equal (GE): ..', 16, 0b1111, '', ''),
+    ('if/then/else (IT): .', 10, 0b111111, '06b', ' (IT[7:2)'),
+)
+
+# xPSR bits IT[1:0] and IT[7:2]
+_XPSR_IT_MASK = (0b11 << 25) | (0b111111 << 10)
+
+
 class Target(NotifySubscriber):
 
     def __init__(self, gdb_server: GdbServer, gdb_client: GdbClient, auto_connect: bool = True) -> None:
@@ -104,12 +135,7 @@ class Target(NotifySubscriber):
             raise ex
 
         # source script with custom GDB commands (custom Python commands executed in GDB context)
-        my_dir = Path(__file__).absolute().parent
-        gdb_script_file = my_dir.joinpath('./gdb_cmds.py')
-
-        # note: GDB expects paths to be POSIX-formatted.
-        gdb_script_file = str(PurePosixPath(gdb_script_file))
-        self.cli_exec(f'source {gdb_script_file}')
+        self.cli_exec(f'source {_GDB_SCRIPT_FILE}')
 
         self._gdb_srv_quirks = GdbServerQuirks.instantiate_quirks(self)
         self._gdb_client_is_connected = True
@@ -159,6 +185,7 @@ class Target(NotifySubscriber):
             self.exec_noblock('-gdb-exit')
             self._gdb_client.gdb_mi.shutdown()
             self._bp_handler.stop()
+            self.notify_close()
             self._gdb_client = None
             self._gdb_client_is_connected = False
         if self._gdb_server is not None:
@@ -238,28 +265,73 @@ class Target(NotifySubscriber):
         Returns:
             The evaluation result converted to a suitable Python data type.
         """
-        res = self.exec(f'-data-evaluate-expression "{expr}"', timeout=timeout)
+        res = self.exec(_eval_cmd(expr), timeout=timeout)
+        return self._eval_result(expr, res)
+
+    def eval_batch(self, exprs: List[str], timeout: float = None) -> List[Union[int, float, bool, str, None]]:
+        """
+        Evaluates the given expressions in the given order (see eval). All expressions are sent to GDB before waiting
+        for their results.
+
+        Args:
+            exprs: The expressions to be evaluated in the current context of the target.
+            timeout: Optional timeout for waiting for each of the results.
+
+        Returns:
+            The evaluation results converted to suitable Python data types (same order as exprs).
+        """
+        results = self.exec_many([_eval_cmd(expr) for expr in exprs], timeout=timeout)
+        return [self._eval_result(expr, res) for expr, res in zip(exprs, results)]
+
+    def _eval_result(self, expr: str, res: Dict) -> Union[int, float, bool, str, None]:
         if res is None:
             log.warn(f'Eval of {expr} did not succeed (return value is None)!')
             return None
 
         res = res['payload']['value']
-        ret_val = cast_str(res)
-
-        if '<optimized out>' in str(ret_val):
+        if '<optimized out>' in res:
             log.warn(f'Accessed entity {expr} is optimized out in the target binary.')
+            return res
 
-        return ret_val
+        return cast_str(res)
 
     def exec(self, cmd: str, timeout: float = None) -> Dict:
         return self._gdb_client.gdb_mi.write_blocking(cmd, timeout=timeout)
 
+    def exec_many(self, cmds: List[str], timeout: float = None, return_exceptions: bool = False) -> List:
+        """
+        Executes the given MI commands. All commands are sent to GDB before waiting for their results.
+
+        Args:
+            cmds: List of MI commands.
+            timeout: Optional timeout for waiting for each of the results.
+            return_exceptions: If True, the exceptions of failed commands are returned as part of the results instead
+            of being raised.
+
+        Returns:
+            List of results in the same order as the commands.
+        """
+        return self._gdb_client.gdb_mi.write_blocking_many(cmds, timeout=timeout, return_exceptions=return_exceptions)
+
     def exec_noblock(self, cmd: str) -> int:
         return self._gdb_client.gdb_mi.write_non_blocking(cmd)
 
     def cli_exec(self, cmd: str, timeout: float = None) -> Dict:
         return self._gdb_client.gdb_mi.write_blocking(f'-interpreter-exec console "{cmd}"', timeout=timeout)
 
+    def cli_exec_many(self, cmds: List[str], timeout: float = None) -> List[Dict]:
+        """
+        Executes the given CLI commands. All commands are sent to GDB before waiting for their results.
+
+        Args:
+            cmds: List of CLI commands.
+            timeout: Optional timeout for waiting for each of the results.
+
+        Returns:
+            List of results in the same order as the commands.
+        """
+        return self.exec_many([f'-interpreter-exec console "{cmd}"' for cmd in cmds], timeout=timeout)
+
     ###############################################################################################
     # Execution-related target commands
 
@@ -267,24 +339,33 @@ class Target(NotifySubscriber):
         self._load_elf_file_name = load_elf_file_name
         self._symbol_elf_file_name = symbol_elf_file_name
 
+        cmds: List[str] = []
         if load_elf_file_name is not None:
-            self.exec(f'-file-exec-file {self._load_elf_file_name}')
+            cmds.append(f'-file-exec-file {self._load_elf_file_name}')
         if symbol_elf_file_name is not None:
-            self.exec(f'-file-symbol-file')  # note: -file-symbol-file without arguments clears GDB's symbol table
-            self.exec(f'-file-symbol-file {self._symbol_elf_file_name}')
+            cmds.append(f'-file-symbol-file')  # note: -file-symbol-file without arguments clears GDB's symbol table
+            cmds.append(f'-file-symbol-file {self._symbol_elf_file_name}')
 
-        self.cli_exec(f'monitor flash device {self._gdb_server.device_id}')
+        cmds.append(f'-interpreter-exec console "monitor flash device {self._gdb_server.device_id}"')
 
         if enable_flash:
-            self.cli_exec('monitor flash download=1')
+            cmds.append('-interpreter-exec console "monitor flash download=1"')
+
+        try:
+            self.exec_many(cmds)
+        finally:
+            # note: GDB's symbol table may have been cleared or replaced even if a command of the batch failed
+            if symbol_elf_file_name is not None:
+                self._symbols.invalidate()
 
         if load_elf_file_name is not None:
             self.exec('-target-download')
 
     def reset(self, flush_reg_cache: bool = True) -> None:
-        self.cli_exec(self._gdb_srv_quirks.monitor_reset)
         if flush_reg_cache:
-            self.reg_flush_cache()
+            self.cli_exec_many([self._gdb_srv_quirks.monitor_reset, 'flushregs'])
+        else:
+            self.cli_exec(self._gdb_srv_quirks.monitor_reset)
 
     def cont(self) -> None:
         """
@@ -334,15 +415,15 @@ class Target(NotifySubscriber):
         with self._cv_target_state:
             self._is_target_running = True
         self.exec('-exec-step')
-        while self.is_running():
-            pass
+        with self._cv_target_state:
+            self._cv_target_state.wait_for(lambda: not self._is_target_running)
 
     def step_inst(self):
         with self._cv_target_state:
             self._is_target_running = True
         self.exec('-exec-step-instruction')
-        while self.is_running():
-            pass
+        with self._cv_target_state:
+            self._cv_target_state.wait_for(lambda: not self._is_target_running)
 
     ###############################################################################################
     # Status-related target commands
@@ -367,19 +448,43 @@ class Target(NotifySubscriber):
             else:
                 log.warn(f'Unhandled notification: {notify_msg}')
 
-    def _internal_wait_halted(self, wait_secs: float = 1.0):
-        start_time = time.time()
-        while (time.time() - start_time) <= wait_secs:
+    def set_halted_by_notification(self) -> None:
+        """
+        Marks the target as halted. Used by breakpoint handling which has received a 'stopped' notification from GDB
+        (i.e., the target is known to be halted) to not depend on the notification delivery to this target instance.
+        """
+        with self._cv_target_state:
+            self._is_target_running = False
+            self._cv_target_state.notify_all()
+
+    def _internal_wait_halted(self, probe_secs: float = 0.1) -> bool:
+        """
+        Fallback for wait_halted if no 'stopped' notification was received in time: asks GDB directly if the target is
+        halted. Probes are repeated with exponential backoff (starting at 1 ms) for up to probe_secs seconds.
+
+        Returns:
+            True if GDB reports the target as halted (the internal state is updated accordingly), False otherwise.
+        """
+        deadline = time.monotonic() + probe_secs
+        backoff = 0.001
+        while True:
             try:
                 # Note: Ideally the documented (but not implemented) GDB MI command "-target-exec-status" would be used
-                # here to check if the target is halted or not. As an alternative, an info command is used which
-                # raises and exception if the target is running.
-                self.exec('-thread-info')
-                # command succeeded => target is halted
-                return
-            except:
-                time.sleep(0)  # yield current thread
-        raise DottException(f'Target not halted within {wait_secs} second(s) despite reported as "stopped" by GDB.')
+                # here to check if the target is halted or not. As an alternative, the thread states are queried.
+                res = self.exec('-thread-info')
+                threads = (res.get('payload') or {}).get('threads', [])
+                if not any(t.get('state') == 'running' for t in threads):
+                    with self._cv_target_state:
+                        self._is_target_running = False
+                        self._cv_target_state.notify_all()
+                    return True
+            except Exception:
+                pass  # command rejected while the target is running
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(backoff, remaining))
+            backoff *= 2
 
     def is_running(self) -> bool:
         """
@@ -403,10 +508,13 @@ class Target(NotifySubscriber):
             wait_secs = self._state_change_wait_secs
 
         with self._cv_target_state:
-            if self._is_target_running:
-                self._cv_target_state.wait(wait_secs)
-            if self._is_target_running:
-                raise DottException(f'Target did not change to "halted" state within {wait_secs} seconds.')
+            # note: wait_for keeps waiting (within the overall timeout) if woken up by an unrelated state change
+            if self._cv_target_state.wait_for(lambda: not self._is_target_running, wait_secs):
+                return
+
+        # no 'stopped' notification within wait_secs; ask GDB before giving up
+        if not self._internal_wait_halted():
+            raise DottException(f'Target did not change to "halted" state within {wait_secs} seconds.')
 
     def wait_running(self, wait_secs: float = None) -> None:
         """
@@ -420,18 +528,16 @@ class Target(NotifySubscriber):
             wait_secs = self._state_change_wait_secs
 
         with self._cv_target_state:
-            if not self._is_target_running:
-                self._cv_target_state.wait(wait_secs)
-            if not self._is_target_running:
+            if not self._cv_target_state.wait_for(lambda: self._is_target_running, wait_secs):
                 raise DottException(f'Target did not change to "running" state within {wait_secs} seconds.')
 
     ###############################################################################################
     # Breakpoint-related target commands
 
     def bp_clear_all(self) -> None:
-        self.cli_exec('dott-bp-nostop-delete')
-        self.exec('-break-delete')
-        self.cli_exec(self._gdb_srv_quirks.monitor_clear_all_bps)
+        self.exec_many(['-interpreter-exec console "dott-bp-nostop-delete"',
+                        '-break-delete',
+                        f'-interpreter-exec console "{self._gdb_srv_quirks.monitor_clear_all_bps}"'])
 
     def bp_get_count(self) -> int:
         res = self.exec('-break-list')
@@ -480,18 +586,12 @@ class Target(NotifySubscriber):
 
         Returns: Multi-line string with human-readable description of xPSR content. Ready for printing/logging.
         """
-        ret: str = f'xPSR: 0b{xpsr:032b} (0x{xpsr:08x})' + os.linesep
-        ret += f'negative (N):. ..... {(xpsr & (0b1 << 31)) >> 31}' + os.linesep
-        ret += f'zero (Z): .......... {(xpsr & (0b1 << 30)) >> 30}' + os.linesep
-        ret += f'carry (C): ......... {(xpsr & (0b1 << 29)) >> 29}' + os.linesep
-        ret += f'overflow (V): ...... {(xpsr & (0b1 << 28)) >> 28}' + os.linesep
-        ret += f'cumulative sat. (Q): {(xpsr & (0b1 << 27)) >> 27}' + os.linesep
-        ret += f'if/then/else (IT): . {(xpsr & (0b11 << 25)) >> 25:02b}     (IT[1:0)' + os.linesep
-        ret += f'thumb state (T): ... {(xpsr & (0b1 << 24)) >> 24}' + os.linesep
-        ret += f'gt or equal (GE): .. {(xpsr & (0b1111 << 16)) >> 16}' + os.linesep
-        ret += f'if/then/else (IT): . {(xpsr & (0b111111 << 10)) >> 10:06b} (IT[7:2)' + os.linesep
+        lines = [f'xPSR: 0b{xpsr:032b} (0x{xpsr:08x})']
+        lines += [f'{label} {format((xpsr >> shift) & mask, fmt)}{suffix}'
+                  for label, shift, mask, fmt, suffix in _XPSR_FIELDS]
+        lines.append('')  # trailing line separator
 
-        return ret
+        return os.linesep.join(lines)
 
     def reg_xpsr_in_it_block(self, xpsr: int) -> bool:
         """
@@ -504,6 +604,4 @@ class Target(NotifySubscriber):
 
         Returns: Returns True if is executing an IT block, false otherwise.
         """
-        if (xpsr & (0b11 << 25)) >> 25 > 0 or (xpsr & (0b111111 << 10)) >> 10 > 0:
-            return True
-        return False
+        return (xpsr & _XPSR_IT_MASK) != 0
@@ -21,6 +21,7 @@
 import logging
 import struct
 import threading
+import time
 from typing import Union, List
 
 log = logging.getLogger('DOTT')
@@ -44,9 +45,10 @@ def DOTT_LABEL(name: str) -> str:
 def singleton(cls, *args, **kw):
     instances = {}
 
-    def _singleton():
+    def _singleton(*inst_args, **inst_kw):
+        # arguments are only considered when the instance is created (i.e., on the first call)
         if cls not in instances:
-            instances[cls] = cls(*args, **kw)
+            instances[cls] = cls(*args, *inst_args, **kw, **inst_kw)
         return instances[cls]
 
     return _singleton
@@ -356,21 +358,36 @@ def cast_str(data: Union[str, bytes]) -> Union[int, float, bool, str]:
 
 # -------------------------------------------------------------------------------------------------
 class BlockingDict(object):
+    # Dictionary with a pop operation which blocks until the requested key is available. Waiting threads are woken up
+    # per key, i.e., a put only wakes up the thread(s) waiting for the key just put (and not all waiting threads).
     def __init__(self):
         self._items = {}
-        self._cv = threading.Condition()
+        self._waiters = {}
+        self._lock = threading.Lock()
 
     def put(self, key, value):
-        with self._cv:
+        with self._lock:
             self._items[key] = value
-            self._cv.notify_all()
-
-    def pop(self, key, timeout: float =None):
-        with self._cv:
-            while key not in self._items:
-                new_item = self._cv.wait(timeout)
-                if not new_item:
-                    # timeout hit
-                    raise TimeoutError
-
-            return self._items.pop(key)
+            waiter = self._waiters.pop(key, None)
+        if waiter is not None:
+            waiter.set()
+
+    def pop(self, key, timeout: float = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if key in self._items:
+                    return self._items.pop(key)
+                waiter = self._waiters.get(key)
+                if waiter is None:
+                    waiter = self._waiters[key] = threading.Event()
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if (remaining is not None and remaining <= 0) or not waiter.wait(remaining):
+                with self._lock:
+                    if key in self._items:
+                        return self._items.pop(key)
+                    if self._waiters.get(key) is waiter:
+                        del self._waiters[key]
+                # timeout hit
+                raise TimeoutError